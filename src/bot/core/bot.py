@@ -1,16 +1,21 @@
 import logging
+import time
 from asyncio import AbstractEventLoop, Event
-from collections import Counter, deque
+from collections import Counter
+from math import isfinite
 from random import SystemRandom
-from statistics import mean
-from typing import List, Union
+from typing import Dict, List, Union
 
 import discord
 from aiohttp import ClientSession
 from discord.ext import commands
 
 import config
+from utils.histogram import Histogram
+from utils.rates import EventRates
 from web import ipc
+from .counters import Counters
+from .usage import LiveUsage
 
 log = logging.getLogger("bot")
 logging.basicConfig(level=logging.INFO)
@@ -26,24 +31,79 @@ async def test(text):
 @ipc.route(name="stats")
 async def cool(bot):
     return {
-        "users": format(sum(1 for i in bot.users if not i.bot), ","),
-        "guilds": format(len(bot.guilds), ","),
+        "users": format(bot.counters.unique_humans, ","),
+        "guilds": format(bot.counters.totals["guilds"], ","),
     }
 
 
+@ipc.route(name="queries")
+async def queries(bot, kwargs=None):
+    kwargs = kwargs or {}
+    stats = bot.pool.query_stats
+    return {
+        "queries": stats.summary(sort=kwargs.get("sort", "total"), limit=kwargs.get("limit", 20)),
+        "slow": [query._asdict() for query in stats.slow],
+    }
+
+
+@ipc.route(name="pools")
+async def pools(bot):
+    return bot.pool.stats()
+
+
+@ipc.route(name="usage")
+async def usage(bot):
+    return bot.usage.summary()
+
+
+@ipc.route(name="socket_rates")
+async def socket_rates(bot):
+    rates = bot.extra.socket_rates
+    return {"total": rates.total(), "events": rates.rates()}
+
+
+@ipc.route(name="latency")
+async def latency(bot):
+    return bot.extra.latencies()
+
+
+@ipc.stream(name="metrics")
+def metrics(bot):
+    """Yields what changed since the previous value, so subscribers can apply it as a delta."""
+    socket, commands_ = Counter(), Counter()
+    while True:
+        latency = bot.latency * 1000
+        yield {
+            "socket": bot.extra.socket_stats - socket,
+            "commands": bot.extra.command_stats - commands_,
+            "latency": round(latency, 2) if isfinite(latency) else None,
+        }
+        socket, commands_ = bot.extra.socket_stats.copy(), bot.extra.command_stats.copy()
+
+
 def get_prefix(bot: "CustomBot", message: discord.Message) -> Union[List[str], str]:
     return commands.when_mentioned_or(*config.prefix)(bot, message)
 
 
 class Extra:
     def __init__(self):
-        self.message_latencies = deque(maxlen=500)
         self.socket_stats = Counter()
+        self.socket_rates = EventRates()
         self.command_stats = Counter()
 
-    @property
-    def message_latency(self):
-        return 1000 * mean(lat.total_seconds() for lat in self.message_latencies)
+        # gateway heartbeat round trips, recorded on every heartbeat ACK
+        self.gateway_latency = Histogram(lowest=1e-3)
+        # from a message being sent to the command it triggered being invoked
+        self.message_latency = Histogram(lowest=1e-3)
+        # execution time per command, by qualified name
+        self.command_times: Dict[str, Histogram] = {}
+
+    def latencies(self) -> dict:
+        return {
+            "gateway": self.gateway_latency.summary(),
+            "message": self.message_latency.summary(),
+            "commands": {name: histogram.summary() for name, histogram in sorted(self.command_times.items())},
+        }
 
 
 class CustomBot(commands.Bot):
@@ -69,19 +129,23 @@ class CustomBot(commands.Bot):
 
         self.random = SystemRandom()
         self.extra = Extra()
+        self.counters = Counters(self)
+        self.usage = LiveUsage()
         self.start_time = None
 
-        self.ipc = ipc.Server(self)
+        self.ipc = ipc.Server(self, path=config.ipc_path)
         self.ipc.start()
 
         self.context = commands.Context
+        self.before_invoke(self.start_timing)
+        self.after_invoke(self.stop_timing)
 
     async def __prep(self):
         self.session = ClientSession(
             headers={"User-Agent": "Walrus (https://github.com/ppotatoo/bot-rewrite)"}
         )
         await self.wait_until_ready()
-        async with self.pool.acquire() as conn:
+        async with self.pool.workload("background").acquire() as conn:
             await conn.executemany(
                 "INSERT INTO public.guilds (id) VALUES ($1) ON CONFLICT DO NOTHING",
                 tuple((g.id,) for g in self.guilds),
@@ -103,6 +167,7 @@ class CustomBot(commands.Bot):
             "extensions.casino",
             "extensions.useful",
             "extensions.giveaways",
+            "extensions.stats",
         ]
         for ext in extensions:
             self.load_extension("bot." + ext)
@@ -121,10 +186,43 @@ class CustomBot(commands.Bot):
         super().run(*args, **kwargs)
 
     async def close(self):
-        await self.session.close()
-        await self.pool.close()
+        steps = []
+        background = self.get_cog("BackgroundEvents")
+        if background is not None:
+            steps.append(background.flush)
+
+        reminders = self.get_cog("Reminders")
+        if reminders is not None:
+            steps.append(reminders.persist_short_timers)
+
+        giveaways = self.get_cog("Giveaways")
+        if giveaways is not None:
+            # queued giveaways have no timer left to retry them, so they are ended before closing
+            steps.append(giveaways.drain)
+
+        steps += [self.session.close, self.pool.close_all]
+        for step in steps:
+            try:
+                await step()
+            except Exception:
+                # one failing step mustn't keep the rest, or the gateway connection, from closing
+                log.exception(f"{step.__qualname__} failed while closing")
+
         await super().close()
 
+    async def start_timing(self, ctx: commands.Context):
+        # groups run the hooks again for their subcommand, only the first invoke counts
+        if getattr(ctx, "invoked_at", None) is None:
+            delay = (discord.utils.utcnow() - ctx.message.created_at).total_seconds()
+            self.extra.message_latency.record(max(delay, 0.0))
+        ctx.invoked_at = time.perf_counter()
+
+    async def stop_timing(self, ctx: commands.Context):
+        name = ctx.command.qualified_name
+        if name not in self.extra.command_times:
+            self.extra.command_times[name] = Histogram(lowest=1e-4)
+        self.extra.command_times[name].record(time.perf_counter() - ctx.invoked_at)
+
     async def on_ready(self):
         log.info("Connected to Discord.")
 
@@ -0,0 +1,123 @@
+import logging
+from collections import Counter
+from typing import Iterable, Tuple
+
+import discord
+from discord.ext import tasks
+
+log = logging.getLogger("bot.counters")
+
+__all__ = ("Counters",)
+
+
+class Counters:
+    """Population totals that are counted once when the bot is ready and then kept up to date from events.
+
+    Walking every guild, member and channel is far too slow to do per command, so the totals are
+    adjusted as guilds, members and channels come and go. A periodic drift check recounts everything
+    and corrects (and logs) any difference.
+    """
+
+    FIELDS = ("guilds", "humans", "bots", "text", "voice")
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        # bot user id -> number of guilds it is in, used to tell unique humans apart from bots
+        self._bot_users = Counter()
+
+        for listener in (
+            self.on_ready,
+            self.on_guild_join,
+            self.on_guild_remove,
+            self.on_guild_available,
+            self.on_guild_unavailable,
+            self.on_member_join,
+            self.on_member_remove,
+            self.on_guild_channel_create,
+            self.on_guild_channel_delete,
+        ):
+            bot.add_listener(listener)
+
+    @property
+    def unique_humans(self) -> int:
+        # bot.users copies the user cache, which is fine for the IPC stats route, the web server caches it
+        return len(self.bot.users) - len(self._bot_users)
+
+    def count(self) -> Tuple[dict, Counter]:
+        totals = dict.fromkeys(self.FIELDS, 0)
+        bot_users = Counter()
+        for guild in self.bot.guilds:
+            totals["guilds"] += 1
+            if guild.unavailable is True:
+                continue
+            add_guild(guild, totals, bot_users, 1)
+
+        return totals, bot_users
+
+    async def on_ready(self):
+        self.totals, self._bot_users = self.count()
+        if not self.drift_check.is_running():
+            self.drift_check.start()
+
+    async def on_guild_join(self, guild: discord.Guild):
+        self.totals["guilds"] += 1
+        add_guild(guild, self.totals, self._bot_users, 1)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.totals["guilds"] -= 1
+        if guild.unavailable is False:
+            add_guild(guild, self.totals, self._bot_users, -1)
+
+    async def on_guild_available(self, guild: discord.Guild):
+        # guilds that come up while connecting are covered by the count in on_ready
+        if self.bot.is_ready():
+            add_guild(guild, self.totals, self._bot_users, 1)
+
+    async def on_guild_unavailable(self, guild: discord.Guild):
+        add_guild(guild, self.totals, self._bot_users, -1)
+
+    async def on_member_join(self, member: discord.Member):
+        add_member(member, self.totals, self._bot_users, 1)
+
+    async def on_member_remove(self, member: discord.Member):
+        add_member(member, self.totals, self._bot_users, -1)
+
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        add_channels((channel,), self.totals, 1)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        add_channels((channel,), self.totals, -1)
+
+    @tasks.loop(hours=1)
+    async def drift_check(self):
+        totals, bot_users = self.count()
+        drift = {field: totals[field] - self.totals[field] for field in self.FIELDS}
+        if any(drift.values()):
+            log.warning(f"Population counters drifted, correcting: {drift}")
+        self.totals, self._bot_users = totals, bot_users
+
+
+def add_guild(guild: discord.Guild, totals: dict, bot_users: Counter, sign: int):
+    for member in guild.members:
+        add_member(member, totals, bot_users, sign)
+    add_channels(guild.channels, totals, sign)
+
+
+def add_member(member: discord.Member, totals: dict, bot_users: Counter, sign: int):
+    if member.bot is True:
+        totals["bots"] += sign
+        bot_users[member.id] += sign
+        if bot_users[member.id] <= 0:
+            del bot_users[member.id]
+    else:
+        totals["humans"] += sign
+
+
+def add_channels(channels: Iterable[discord.abc.GuildChannel], totals: dict, sign: int):
+    for channel in channels:
+        if isinstance(channel, discord.TextChannel):
+            totals["text"] += sign
+        if isinstance(channel, discord.VoiceChannel):
+            totals["voice"] += sign
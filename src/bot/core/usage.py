@@ -0,0 +1,86 @@
+import time
+from datetime import date, datetime as dt, timezone
+from typing import Dict, Optional
+
+from utils.sketches import HyperLogLog, SpaceSaving
+
+__all__ = ("LiveUsage",)
+
+# heavy hitter counts are multiplied by this every minute, halving them about every 7 minutes
+DECAY = 0.9
+# days of unique user counts kept
+DAYS = 7
+
+
+class LiveUsage:
+    """Who is using the bot right now, in fixed memory and without touching the database.
+
+    Top commands, users and guilds are tracked with decaying Space-Saving sketches, unique users
+    per day and per guild (for today) with HyperLogLog.
+    """
+
+    def __init__(self, *, capacity: int = 64):
+        self.commands = SpaceSaving(capacity)
+        self.users = SpaceSaving(capacity)
+        self.guilds = SpaceSaving(capacity)
+
+        self.daily_users: Dict[date, HyperLogLog] = {}
+        self.guild_users: Dict[int, HyperLogLog] = {}
+        self._guild_day: Optional[date] = None
+
+        self._decayed = time.monotonic()
+
+    def _decay(self):
+        minutes = int((time.monotonic() - self._decayed) // 60)
+        if minutes:
+            for sketch in (self.commands, self.users, self.guilds):
+                sketch.decay(DECAY**minutes)
+            self._decayed += minutes * 60
+
+    def record(self, command: str, author: int, guild: Optional[int], when: dt):
+        self._decay()
+        self.commands.add(command)
+        self.users.add(author)
+
+        day = when.astimezone(timezone.utc).date()
+        if day not in self.daily_users:
+            self.daily_users[day] = HyperLogLog()
+            for expired in sorted(self.daily_users)[:-DAYS]:
+                del self.daily_users[expired]
+        self.daily_users[day].add(author)
+
+        if guild is None:
+            return
+        self.guilds.add(guild)
+        if day != self._guild_day:
+            # per guild counts only cover today, so memory is bounded by the guilds active today
+            self.guild_users, self._guild_day = {}, day
+        if guild not in self.guild_users:
+            # lower precision as there is one per guild, about 3% error in 1KB
+            self.guild_users[guild] = HyperLogLog(precision=10)
+        self.guild_users[guild].add(author)
+
+    def unique_users(self, *, day: Optional[date] = None, guild: Optional[int] = None) -> int:
+        if guild is not None:
+            sketch = self.guild_users.get(guild) if day in (None, self._guild_day) else None
+        else:
+            sketch = self.daily_users.get(day or dt.now(timezone.utc).date())
+        return len(sketch) if sketch is not None else 0
+
+    def summary(self, n: int = 10) -> dict:
+        self._decay()
+        top = {
+            name: [
+                {"id": item, "count": round(count, 1), "error": round(error, 1)}
+                for item, count, error in sketch.top(n)
+            ]
+            for name, sketch in (("commands", self.commands), ("users", self.users), ("guilds", self.guilds))
+        }
+        for guild in top["guilds"]:
+            guild["unique_users"] = self.unique_users(guild=guild["id"])
+        return {
+            **top,
+            "unique_users": {
+                day.isoformat(): len(sketch) for day, sketch in sorted(self.daily_users.items())
+            },
+        }
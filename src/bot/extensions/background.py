@@ -1,97 +1,241 @@
 import asyncio
 from collections import Counter
-from json import dumps
+from datetime import datetime as dt, timedelta
 from logging import getLogger
+from math import isfinite
+from typing import Optional, Tuple
 
+import asyncpg
 import discord
+from dateutil.relativedelta import relativedelta
 from discord.ext import commands, tasks
 
+import config
 from .. import core
 from utils.decos import wait_until_prepped
+from utils.spool import CorruptSpool, Spool
 
 __all__ = ("setup",)
 
 log = getLogger(__name__)
 
+# rows kept in memory per buffer before they are spilled to the spool
+MAX_BUFFERED = 10_000
+
+# spool frame kinds
+COMMANDS, NICKNAMES, USERNAMES, SOCKET = range(4)
+
+# hourly rollups are kept this long, daily rollups and totals forever
+HOURLY_RETENTION = timedelta(days=35)
+
+FLUSH_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+TABLES = {
+    COMMANDS: ("stats", "commands", ("guild", "channel", "author", "used", "prefix", "command", "failed")),
+    NICKNAMES: ("users", "nicknames", ("guild", "member", "nickname")),
+    USERNAMES: ("users", "usernames", ("snowflake", "username")),
+}
+
 
 class BackgroundEvents(commands.Cog):
     def __init__(self, bot: core.CustomBot):
         self.bot = bot
-        self._lock = asyncio.Lock(loop=self.bot.loop)
+
+        self.spool = Spool(config.spool_path)
 
         self._command_cache = []
         self._socket_cache = Counter()
         self._nicknames_cache = []
         self._usernames_cache = []
+        # the flush loop and close() can both flush, they must not replay the same spool at once
+        self._flush_lock = asyncio.Lock()
+        # set while flushes fail, full buffers only go to the spool then
+        self._failing = False
+        self._early_flush: Optional[asyncio.Task] = None
 
         self.bulk_insert.start()
+        self.maintain_partitions.start()
 
     def cog_unload(self):
         self.bulk_insert.stop()
+        self.maintain_partitions.cancel()
+        self.spill(self.swap_buffers())
+
+    def swap_buffers(self) -> Tuple[list, list, list, Counter]:
+        """Hands the filled buffers over to the flusher and installs empty ones.
+
+        Nothing is awaited between reading and replacing the buffers, so the listeners
+        can keep appending to the active ones without taking a lock.
+        """
+        commands_, self._command_cache = self._command_cache, []
+        nicknames, self._nicknames_cache = self._nicknames_cache, []
+        usernames, self._usernames_cache = self._usernames_cache, []
+        socket, self._socket_cache = self._socket_cache, Counter()
+
+        return commands_, nicknames, usernames, socket
+
+    def spill(self, buffers: Tuple[list, list, list, Counter]):
+        commands_, nicknames, usernames, socket = buffers
+        for kind, rows in (
+            (COMMANDS, commands_),
+            (NICKNAMES, nicknames),
+            (USERNAMES, usernames),
+            (SOCKET, list(socket.items())),
+        ):
+            if rows:
+                self.spool.write(kind, rows)
+
+    async def spill_later(self, buffers: Tuple[list, list, list, Counter]):
+        # under the flush lock, so it never writes to the spool while a flush is taking or replaying it
+        async with self._flush_lock:
+            await asyncio.get_running_loop().run_in_executor(None, self.spill, buffers)
+
+    def check_overflow(self, buffer: list):
+        """Keeps memory flat when the buffers fill up between two flushes.
+
+        The listeners must not touch the disk, so a healthy database just gets flushed early,
+        and only while flushes are failing are the buffers written to the spool, off the event loop.
+        """
+        if len(buffer) < MAX_BUFFERED:
+            return
+
+        if self._failing:
+            asyncio.create_task(self.spill_later(self.swap_buffers()))
+        elif self._early_flush is None or self._early_flush.done():
+            self._early_flush = asyncio.create_task(self.flush())
+
+    async def write_commands(self, conn, rows: list):
+        """Copies command rows in and adds them to the rollups and totals."""
+        schema, table, columns = TABLES[COMMANDS]
+        await conn.copy_records_to_table(table, schema_name=schema, columns=columns, records=rows)
+
+        counts = Counter(
+            (used.replace(minute=0, second=0, microsecond=0), command, guild or 0, bool(failed))
+            for guild, _, _, used, _, command, failed in rows
+            if used is not None
+        )
+        if counts:
+            rollup = await conn.prepared("stats.commands_rollup")
+            await rollup.fetch(*zip(*((*key, count) for key, count in counts.items())))
+
+            authors = Counter(
+                (used.replace(minute=0, second=0, microsecond=0), guild or 0, author)
+                for guild, _, author, used, _, _, _ in rows
+                if used is not None
+            )
+            users_rollup = await conn.prepared("stats.users_rollup")
+            await users_rollup.fetch(*zip(*((*key, count) for key, count in authors.items())))
+
+        # all time usage, per guild and for every guild combined under guild 0
+        uses, failures, users = Counter(), Counter(), Counter()
+        for guild, _, author, _, _, command, failed in rows:
+            for scope in (0,) if guild is None else (0, guild):
+                uses[scope, command] += 1
+                failures[scope, command] += bool(failed)
+                users[scope, author] += 1
+
+        command_totals = await conn.prepared("stats.command_totals")
+        await command_totals.fetch(*zip(*((*key, count, failures[key]) for key, count in uses.items())))
+        user_totals = await conn.prepared("stats.user_totals")
+        await user_totals.fetch(*zip(*((*key, count) for key, count in users.items())))
+
+    async def write(self, conn, commands_: list, nicknames: list, usernames: list, socket: Counter):
+        if commands_:
+            await self.write_commands(conn, commands_)
+
+        for kind, rows in ((NICKNAMES, nicknames), (USERNAMES, usernames)):
+            if rows:
+                schema, table, columns = TABLES[kind]
+                await conn.copy_records_to_table(table, schema_name=schema, columns=columns, records=rows)
+
+        if socket:
+            names, counts = zip(*socket.items())
+            upsert = await conn.prepared("stats.socket_upsert")
+            await upsert.fetch(names, counts)
+
+    async def replay(self, conn, spool: Spool) -> int:
+        socket = Counter()
+        rows = 0
+        for kind, frame in spool.read():
+            rows += len(frame)
+            if kind == SOCKET:
+                socket.update(dict(frame))
+            elif kind == COMMANDS:
+                await self.write_commands(conn, frame)
+            elif kind not in TABLES:
+                raise CorruptSpool(f"Unknown frame kind {kind} in {spool.path}")
+            else:
+                schema, table, columns = TABLES[kind]
+                await conn.copy_records_to_table(table, schema_name=schema, columns=columns, records=frame)
+
+        await self.write(conn, [], [], [], socket)
+        return rows
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        buffers = self.swap_buffers()
+        replay = self.spool.take() if self.spool else None
+        if not any(buffers) and replay is None:
+            return
+
+        try:
+            async with self.bot.pool.workload("background").acquire(timeout=10) as conn:
+                async with conn.transaction():
+                    replayed = await self.replay(conn, replay) if replay is not None else 0
+                    await self.write(conn, *buffers)
+        except FLUSH_ERRORS as exc:
+            log.warning(f"Could not flush stats, spooling them to {self.spool.path}: {exc!r}")
+            self._failing = True
+            await asyncio.get_running_loop().run_in_executor(None, self.spill, buffers)
+            return
+        except CorruptSpool as exc:
+            # the transaction was rolled back, so the current buffers are spooled for the next flush
+            log.error(f"{exc}, moved the spool to {replay.quarantine()}")
+            await asyncio.get_running_loop().run_in_executor(None, self.spill, buffers)
+            return
+
+        self._failing = False
+        if replay is not None:
+            replay.clear()
+            log.info(f"Replayed {replayed:,} spooled rows.")
 
     @tasks.loop(seconds=10)
     @wait_until_prepped()
     async def bulk_insert(self):
         if self.bot.is_closed():
             return
-        async with self.bot.pool.acquire() as conn:
-            if self._command_cache:
-                async with self._lock:
-                    query = """
-                        INSERT INTO
-                            stats.commands (guild, channel, author, used, prefix, command, failed)
-                        SELECT x.guild, x.channel, x.author, x.used, x.prefix, x.command, x.failed
-                            FROM JSONB_TO_RECORDSET($1::JSONB) AS
-                            x(
-                                    guild BIGINT,
-                                    channel BIGINT,
-                                    author BIGINT,
-                                    used TIMESTAMP,
-                                    prefix TEXT,
-                                    command TEXT,
-                                    failed BOOLEAN
-                            )
-                            """
-                    await conn.execute(query, dumps(self._command_cache))
-                    self._command_cache.clear()
-
-            if self._nicknames_cache:
-                async with self._lock:
-                    query = """
-                        INSERT INTO
-                            users.nicknames (guild, member, nickname)
-                        SELECT x.guild, x.member, x.nickname
-                        FROM JSONB_TO_RECORDSET($1::JSONB)
-                        AS x(guild BIGINT, member BIGINT, nickname TEXT)
-                        """
-                    await conn.execute(query, dumps(self._nicknames_cache))
-                    self._nicknames_cache.clear()
-
-            if self._usernames_cache:
-                async with self._lock:
-                    query = """
-                        INSERT INTO
-                            users.usernames (snowflake, username)
-                        SELECT x.snowflake, x.username
-                        FROM JSONB_TO_RECORDSET($1::JSONB)
-                        AS x(snowflake BIGINT, username TEXT)
-                        """
-                    await conn.execute(query, dumps(self._usernames_cache))
-                    self._usernames_cache.clear()
-
-            if self._socket_cache:
-                async with self._lock:
-                    items = [(name, count) for name, count in self._socket_cache.most_common()]
-                    query = """
-                        INSERT INTO 
-                            stats.socket
-                        VALUES ($1, $2)
-                        ON CONFLICT (name)
-                        DO UPDATE SET 
-                            count = socket.count + $2
-                        """
-                    await conn.executemany(query, items)
-                    self._socket_cache.clear()
+
+        await self.flush()
+
+    @tasks.loop(hours=6)
+    @wait_until_prepped()
+    async def maintain_partitions(self):
+        """Creates the stats.commands partitions for this month and the next, and drops expired ones.
+
+        Dropped partitions lose nothing, their rows were counted into the rollups as they were written.
+        """
+        this_month = dt.utcnow().date().replace(day=1)
+        expired = this_month - relativedelta(months=config.command_retention_months)
+
+        try:
+            async with self.bot.pool.workload("background").acquire(timeout=10) as conn:
+                for month in (this_month, this_month + relativedelta(months=1)):
+                    await conn.execute("SELECT stats.create_command_partition($1)", month)
+                dropped = await conn.fetch("SELECT * FROM stats.drop_command_partitions($1)", expired)
+                for table in ("commands_hourly", "users_hourly"):
+                    await conn.execute(
+                        f"DELETE FROM stats.{table} WHERE hour < $1", dt.utcnow() - HOURLY_RETENTION
+                    )
+        except FLUSH_ERRORS as exc:
+            # next month's partition is created a month early, so the next run is soon enough to retry
+            log.warning(f"Could not maintain the command partitions: {exc!r}")
+            return
+
+        if dropped:
+            log.info(f"Dropped expired command partitions: {', '.join(row[0] for row in dropped)}")
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx: core.CustomContext):
@@ -99,39 +243,47 @@ class BackgroundEvents(commands.Cog):
             return
 
         self.bot.extra.command_stats[ctx.command.qualified_name] += 1
-        async with self._lock:
-            self._command_cache.append(
-                {
-                    "guild": getattr(ctx.guild, "id", None),
-                    "channel": ctx.channel.id,
-                    "author": ctx.author.id,
-                    "used": ctx.message.created_at.isoformat(),
-                    "prefix": ctx.clean_prefix,
-                    "command": ctx.command.qualified_name,
-                    "failed": ctx.command_failed,
-                }
+        self.bot.usage.record(
+            ctx.command.qualified_name, ctx.author.id, getattr(ctx.guild, "id", None), ctx.message.created_at
+        )
+        self._command_cache.append(
+            (
+                getattr(ctx.guild, "id", None),
+                ctx.channel.id,
+                ctx.author.id,
+                # stats.commands.used is a naive TIMESTAMP, stored as UTC
+                ctx.message.created_at.replace(tzinfo=None),
+                ctx.clean_prefix,
+                ctx.command.qualified_name,
+                ctx.command_failed,
             )
+        )
+        self.check_overflow(self._command_cache)
 
     @commands.Cog.listener()
     async def on_socket_response(self, data):
         if event := data.get("t"):
             self.bot.extra.socket_stats[event] += 1
+            self.bot.extra.socket_rates.add(event)
 
             self._socket_cache[event] += 1
+        elif data.get("op") == 11:
+            # heartbeat ACK, which bot.latency has just been updated from
+            latency = self.bot.latency
+            if isfinite(latency):
+                self.bot.extra.gateway_latency.record(latency)
 
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member):
         if before.display_name != after.display_name and after.nick is not None:
-            async with self._lock:
-                self._nicknames_cache.append(
-                    {"guild": after.guild.id, "member": after.id, "nickname": after.nick}
-                )
+            self._nicknames_cache.append((after.guild.id, after.id, after.nick))
+            self.check_overflow(self._nicknames_cache)
 
     @commands.Cog.listener()
     async def on_user_update(self, before: discord.User, after: discord.User):
         if before.name != after.name:
-            async with self._lock:
-                self._usernames_cache.append({"snowflake": after.id, "username": after.name})
+            self._usernames_cache.append((after.id, after.name))
+            self.check_overflow(self._usernames_cache)
 
 
 def setup(bot: core.CustomBot):
@@ -1,11 +1,13 @@
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 import discord
 from discord.ext import commands
 
 from .. import core
 from utils import codeblock
+from utils.rates import EventRates
 
 __all__ = ("setup",)
 
@@ -60,20 +62,32 @@ class General(commands.Cog):
         self.bot = bot
         self.emoji = "<a:pop_cat:854027957878390784>"
 
-    async def send_socket_stats(self, ctx, stats, *, omit_minutes: bool = False) -> None:
-        minutes = (discord.utils.utcnow() - self.bot.start_time).total_seconds() / 60
+    async def send_socket_stats(self, ctx, stats, *, rates: Optional[EventRates] = None) -> None:
         total = 0
         lines = []
 
+        # events per second, over the last second, 1, 5 and 15 minutes, then the busiest second
+        columns = ("current", "1m", "5m", "15m")
+        if rates is not None:
+            per_event = rates.rates()
+            lines.append(f"{'':<24}{'count':<10}{'now':<7}{'1m':<7}{'5m':<7}{'15m':<7}peak\n")
+
         for name, count in stats:
             total += count
-            if not omit_minutes:
-                lines.append(f"{name:<30}{count:<18}{round(count / minutes)} / minute\n")
+            if rates is not None:
+                rate = per_event.get(name, dict.fromkeys((*columns, "peak"), 0))
+                lines.append(
+                    f"{name:<24}{count:<10}{''.join(f'{rate[c]:<7}' for c in columns)}{rate['peak']}\n"
+                )
             else:
                 lines.append(f"{name:<30}{count:<18}\n")
 
-        if not omit_minutes:
-            msg = f"{''.join(lines)}\n{'TOTAL':<30}{total:<18}{round(total / minutes)} / minute"
+        if rates is not None:
+            rate = rates.total()
+            msg = (
+                f"{''.join(lines)}\n"
+                f"{'TOTAL':<24}{total:<10}{''.join(f'{rate[c]:<7}' for c in columns)}{rate['peak']}"
+            )
         else:
             msg = f"{''.join(lines)}\n{'TOTAL':<30}{total:<18}"
 
@@ -81,17 +95,20 @@ class General(commands.Cog):
 
     @core.group(
         aliases=("socketstats", "socket_stats", "events"),
-        returns="A chart showing socket stats of this bot.",
+        returns="A chart showing socket stats of this bot, with events per second.",
         invoke_without_command=True,
     )
     async def socket(self, ctx: core.CustomContext):
-        await self.send_socket_stats(ctx, self.bot.extra.socket_stats.most_common())
+        await self.send_socket_stats(
+            ctx, self.bot.extra.socket_stats.most_common(), rates=self.bot.extra.socket_rates
+        )
 
     @socket.command(name="total", aliases=("all",), returns="A table showing the total socket stats")
     async def socket_total(self, ctx: core.CustomContext):
-        raw = await self.bot.pool.fetch("SELECT name, count FROM stats.socket ORDER BY count DESC")
+        analytics = self.bot.pool.workload("analytics")
+        raw = await analytics.fetch("SELECT name, count FROM stats.socket ORDER BY count DESC")
         stats = [(i["name"], i["count"]) for i in raw]
-        await self.send_socket_stats(ctx, stats, omit_minutes=True)
+        await self.send_socket_stats(ctx, stats)
 
     @core.command(returns="Things about the bot.")
     async def about(self, ctx: core.CustomContext):
@@ -100,26 +117,14 @@ class General(commands.Cog):
         me = await self.bot.getch_user(self.bot.owner_id)
         embed.set_author(name=str(me))
 
-        guilds = users = bots = text = voice = 0
-        for guild in self.bot.guilds:
-            guilds += 1
-            if guild.unavailable is True:
-                continue
-
-            for user in guild.members:
-                if user.bot is True:
-                    bots += 1
-                else:
-                    users += 1
-
-            for channel in guild.channels:
-                if isinstance(channel, discord.TextChannel):
-                    text += 1
-                if isinstance(channel, discord.VoiceChannel):
-                    voice += 1
+        totals = self.bot.counters.totals
+        guilds, users, bots, text, voice = (
+            totals[field] for field in ("guilds", "humans", "bots", "text", "voice")
+        )
 
-        cmds = await self.bot.pool.fetchval("SELECT COUNT(*) FROM stats.commands")
-        socket = await self.bot.pool.fetch("SELECT * FROM stats.socket")
+        analytics = self.bot.pool.workload("analytics")
+        cmds = await analytics.fetchval("SELECT count FROM stats.totals WHERE name = 'commands'") or 0
+        socket = await analytics.fetch("SELECT * FROM stats.socket")
         total = 0
         total_messages = 0
         for stat in socket:
@@ -1,18 +1,24 @@
 import asyncio
+import logging
 from datetime import datetime as dt, timedelta
+from json import loads
 from random import choice
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
+import asyncpg
 import discord
 from discord import utils
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from .. import core
 from utils.formats import plural
+from utils.queues import KeyedQueue
 from utils.time import parse_time, utcnow
 
 __all__ = ("setup",)
 
+log = logging.getLogger(__name__)
+
 tadas = (
     "<a:tada1:856337025666121768>",
     "<a:tada2:856679655117553695>",
@@ -24,6 +30,25 @@ tadas = (
 )
 
 
+FINALISER_WORKERS = 4
+# how long unloading waits for queued giveaways to end, their timers are already gone
+DRAIN_TIMEOUT = 30
+
+ENTRANTS_INSERT = """
+    INSERT INTO
+        events.giveaway_entrants (message, member)
+    SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[])
+    ON CONFLICT DO NOTHING
+    """
+
+ENTRANTS_DELETE = """
+    DELETE FROM
+        events.giveaway_entrants
+    WHERE
+        (message, member) IN (SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[]))
+    """
+
+
 def random_tada():
     return choice(tadas)
 
@@ -113,6 +138,158 @@ class Giveaways(commands.Cog):
         self.emoji = random_tada()
         self.show_subcommands = True
 
+        # message id -> emoji id of every running giveaway
+        self._active: Dict[int, int] = {}
+        # (message, member) pairs waiting to be written to events.giveaway_entrants
+        self._entered: Set[Tuple[int, int]] = set()
+        self._left: Set[Tuple[int, int]] = set()
+
+        # ending giveaways are edited and announced one at a time per channel
+        self.finaliser = KeyedQueue(self.finalise, workers=FINALISER_WORKERS, loop=self.bot.loop)
+
+        self.flush_entrants_loop.start()
+        self.bot.loop.create_task(self.load_active())
+
+    def cog_unload(self):
+        self.flush_entrants_loop.cancel()
+        self.bot.loop.create_task(self.drain())
+
+    async def drain(self):
+        """Ends the giveaways that are still queued and stops the finaliser."""
+        await self.finaliser.drain(DRAIN_TIMEOUT)
+
+    async def load_active(self):
+        """Picks up running giveaways and repairs any entrants missed while the bot was offline."""
+        await self.bot.wait_until_ready()
+        await self.backfill()
+        giveaways = await self.bot.pool.workload("background").fetch(
+            "SELECT message, channel, emoji FROM events.giveaways WHERE ended = FALSE"
+        )
+        for giveaway in giveaways:
+            self._active[giveaway["message"]] = giveaway["emoji"]
+
+        for giveaway in giveaways:
+            try:
+                await self.reconcile_entrants(giveaway["channel"], giveaway["message"], giveaway["emoji"])
+            except discord.HTTPException:
+                continue
+
+    async def backfill(self):
+        """Records giveaways started before events.giveaways existed, from their timers.
+
+        Only their timer knows about them, which has everything but the guild, so that is looked
+        up from the channel.
+        """
+        pool = self.bot.pool.workload("background")
+        query = """
+            SELECT
+                data, expires
+            FROM
+                events.timers
+            WHERE
+                event = 'giveaway'
+                AND NOT EXISTS (
+                    SELECT 1 FROM events.giveaways WHERE message = (timers.data->>'message')::BIGINT
+                )
+            """
+        records = []
+        for timer in await pool.fetch(query):
+            data = loads(timer["data"])
+            try:
+                channel = self.bot.get_channel(data["channel"]) or (
+                    await self.bot.fetch_channel(data["channel"])
+                )
+            except discord.HTTPException:
+                log.warning(f"Could not backfill giveaway {data['message']}, its channel is gone")
+                continue
+            records.append(
+                (
+                    data["message"],
+                    data["channel"],
+                    channel.guild.id,
+                    data["emoji"],
+                    data["prize"],
+                    data["winners"],
+                    timer["expires"],
+                )
+            )
+
+        if records:
+            query = """
+                INSERT INTO
+                    events.giveaways (message, channel, guild, emoji, prize, winners, expires)
+                VALUES
+                    ($1, $2, $3, $4, $5, $6, $7)
+                ON CONFLICT (message) DO NOTHING
+                """
+            await pool.executemany(query, records)
+            log.info(f"Backfilled {len(records)} giveaways from their timers.")
+
+    async def reconcile_entrants(self, channel_id: int, message_id: int, emoji: int):
+        channel = self.bot.get_channel(channel_id) or (await self.bot.fetch_channel(channel_id))
+        message = await channel.fetch_message(message_id)
+        reaction = utils.get(message.reactions, emoji__id=emoji)
+        members = [user.id async for user in reaction.users() if user.bot is False] if reaction else []
+
+        async with self.bot.pool.workload("background").acquire() as conn:
+            async with conn.transaction():
+                query = """
+                    DELETE FROM
+                        events.giveaway_entrants
+                    WHERE
+                        message = $1 AND NOT member = ANY($2::BIGINT[])
+                    """
+                await conn.execute(query, message_id, members)
+                await conn.execute(ENTRANTS_INSERT, [message_id] * len(members), members)
+
+    def track_entrant(self, message_id: int, member_id: int, *, entered: bool):
+        key = (message_id, member_id)
+        if entered:
+            self._left.discard(key)
+            self._entered.add(key)
+        else:
+            self._entered.discard(key)
+            self._left.add(key)
+
+    async def flush_entrants(self):
+        entered, self._entered = self._entered, set()
+        left, self._left = self._left, set()
+        if not (entered or left):
+            return
+
+        try:
+            async with self.bot.pool.workload("background").acquire() as conn:
+                if entered:
+                    await conn.execute(ENTRANTS_INSERT, *zip(*entered))
+                if left:
+                    await conn.execute(ENTRANTS_DELETE, *zip(*left))
+        except BaseException:
+            # put them back for the next flush, unless the member reacted again in the meantime
+            self._entered |= {key for key in entered if key not in self._left}
+            self._left |= {key for key in left if key not in self._entered}
+            raise
+
+    @tasks.loop(seconds=5)
+    async def flush_entrants_loop(self):
+        try:
+            await self.flush_entrants()
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as exc:
+            log.warning(f"Could not flush giveaway entrants, retrying: {exc!r}")
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if self._active.get(payload.message_id) != payload.emoji.id:
+            return
+        if payload.member is None or payload.member.bot:
+            return
+        self.track_entrant(payload.message_id, payload.user_id, entered=True)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        if self._active.get(payload.message_id) != payload.emoji.id:
+            return
+        self.track_entrant(payload.message_id, payload.user_id, entered=False)
+
     @core.group(aliases=("g", "raffle"), invoke_without_command=True)
     async def giveaway(self, ctx: core.CustomContext):
         await ctx.send_help(ctx.command)
@@ -209,65 +386,127 @@ class Giveaways(commands.Cog):
             "winners": winners,
             "emoji": int(selected_tada.rstrip(">").split(":")[2]),
         }
+        query = """
+            INSERT INTO
+                events.giveaways (message, channel, guild, emoji, prize, winners, expires)
+            VALUES
+                ($1, $2, $3, $4, $5, $6, $7)
+            """
+        await self.bot.pool.execute(
+            query, message.id, channel.id, channel.guild.id, data["emoji"], prize, winners, expires
+        )
+        self._active[message.id] = data["emoji"]
         await timer.create_timer("giveaway", utcnow(), expires, data)
         await m.add_reaction("✅")
 
     @giveaway.command(name="reroll", aliases=("newwinner",))
     async def giveaway_reroll(self, ctx: core.CustomContext, message: discord.Message = None):
         if message is None:
-            async for msg in ctx.history(limit=100):
-                check = await self.validate_reroll_message(msg)
-                if check is False:
-                    continue
-                message = msg
-                break
-        if message is None:
+            query = """
+                SELECT
+                    message
+                FROM
+                    events.giveaways
+                WHERE
+                    channel = $1 AND ended = TRUE
+                ORDER BY
+                    expires DESC
+                LIMIT
+                    1
+                """
+            message_id = await self.bot.pool.fetchval(query, ctx.channel.id)
+        else:
+            query = "SELECT message FROM events.giveaways WHERE message = $1 AND ended = TRUE"
+            message_id = await self.bot.pool.fetchval(query, message.id)
+        if message_id is None:
             return await ctx.send("I could not find a giveaway to reroll! " "Try sending the message link.")
-        emoji = message.content.split(" ")[0]
-        winner = await self.get_winners(message, emoji=int(emoji.rstrip(">").split(":")[2]), winners=1)
+        winner = await self.get_winners(message_id, winners=1)
         if not winner:
             await ctx.send("I couldn't determine a winner for that giveaway. :(")
         else:
             winner = winner[0]
-            await ctx.send(f"The new winner is {winner.mention}! Congratulations!")
-
-    async def validate_reroll_message(self, message: discord.Message):
-        if not message.embeds or message.author != self.bot.user:
-            return False
-        embed = message.embeds[0]
-        if embed.footer.text != "Ended at":
-            return False
-        if " __**GIVEAWAY ENDED**__ " not in message.content:
-            return False
-
-        return True
-
-    async def get_winners(
-        self, message: discord.Message, *, emoji: int, winners: int
-    ) -> List[discord.Member]:
-        if not message.reactions:
-            return []
+            await ctx.send(f"The new winner is <@{winner}>! Congratulations!")
+
+    @giveaway.command(name="list", aliases=("recent",))
+    @commands.guild_only()
+    async def giveaway_list(self, ctx: core.CustomContext):
+        query = """
+            SELECT
+                *
+            FROM
+                events.giveaways
+            WHERE
+                guild = $1
+            ORDER BY
+                expires DESC
+            LIMIT
+                10
+            """
+        giveaways = await self.bot.pool.fetch(query, ctx.guild.id)
+        if not giveaways:
+            return await ctx.send(f"{random_tada()} There haven't been any giveaways in this server yet.")
+        await ctx.send(embed=self.giveaways_embed("Recent giveaways", giveaways))
+
+    @giveaway.command(name="active", aliases=("running",))
+    @commands.guild_only()
+    async def giveaway_active(self, ctx: core.CustomContext):
+        query = """
+            SELECT
+                *
+            FROM
+                events.giveaways
+            WHERE
+                guild = $1 AND ended = FALSE
+            ORDER BY
+                expires
+            """
+        giveaways = await self.bot.pool.fetch(query, ctx.guild.id)
+        if not giveaways:
+            return await ctx.send(f"{random_tada()} There are no giveaways running in this server.")
+        await ctx.send(embed=self.giveaways_embed("Running giveaways", giveaways))
+
+    def giveaways_embed(self, title: str, giveaways: list) -> discord.Embed:
+        lines = []
+        for giveaway in giveaways:
+            link = f"https://discord.com/channels/{giveaway['guild']}/{giveaway['channel']}/{giveaway['message']}"
+            state = "Ended" if giveaway["ended"] else "Ends"
+            lines.append(
+                f"[{giveaway['prize']}]({link}) in <#{giveaway['channel']}> - "
+                f"{giveaway['winners']} {plural('winner(s)', giveaway['winners'])}, "
+                f"{state} {utils.format_dt(giveaway['expires'], 'R')}"
+            )
+        return self.bot.embed(title=title, description="\n".join(lines))
 
-        reaction = discord.utils.get(message.reactions, emoji__id=emoji)
-        users = [user async for user in reaction.users() if user.bot is False]
+    async def get_winners(self, message_id: int, *, winners: int) -> List[int]:
+        # make sure the latest reactions are accounted for
+        await self.flush_entrants()
+        rows = await self.bot.pool.fetch(
+            "SELECT member FROM events.giveaway_entrants WHERE message = $1", message_id
+        )
+        entrants = [row["member"] for row in rows]
 
-        return self.bot.random.sample(users, min(len(users), winners))
+        return self.bot.random.sample(entrants, min(len(entrants), winners))
 
     @giveaway_create.error
     async def create_giveaway_error(self, ctx: core.CustomContext, error: Exception):
         if isinstance(error, commands.MaxConcurrencyReached):
             return await ctx.send("Sorry, there is already a giveaway being created in this channel.")
 
-    async def determine_winners(
-        self, message: discord.Message, *, emoji: int, winners: int
-    ) -> List[discord.Member]:
-        reaction = discord.utils.get(message.reactions, emoji__id=emoji)
-        users = [user async for user in reaction.users() if user.bot is False]
-
-        return self.bot.random.sample(users, min(len(users), winners))
+    @giveaway.command(name="queue", hidden=True)
+    @commands.is_owner()
+    async def giveaway_queue(self, ctx: core.CustomContext):
+        percentiles = self.finaliser.percentiles()
+        latencies = ", ".join(f"p{p}: {latency * 1000:.2f} ms" for p, latency in percentiles.items())
+        await ctx.send(
+            f"{len(self.finaliser)} giveaways waiting to be finalised.\n"
+            f"Finalisation latency: {latencies or 'no giveaways finalised yet'}"
+        )
 
     @commands.Cog.listener()
     async def on_giveaway_complete(self, reminder):
+        self.finaliser.put(reminder["data"]["channel"], reminder)
+
+    async def finalise(self, reminder):
         data = reminder["data"]
         try:
             channel: discord.TextChannel = self.bot.get_channel(data["channel"]) or (
@@ -276,14 +515,12 @@ class Giveaways(commands.Cog):
         except discord.HTTPException:
             return
 
-        try:
-            message = utils.get(self.bot.cached_messages, id=data["message"]) or (
-                await channel.fetch_message(data["message"])
-            )
-        except discord.HTTPException:
-            return
+        # winners come from the entrants table, so the message itself never has to be fetched
+        message = channel.get_partial_message(data["message"])
 
-        winners = await self.get_winners(message, emoji=data["emoji"], winners=data["winners"])
+        winners = await self.get_winners(message.id, winners=data["winners"])
+        self._active.pop(message.id, None)
+        await self.bot.pool.execute("UPDATE events.giveaways SET ended = TRUE WHERE message = $1", message.id)
         old = discord.Embed(color=discord.Color.green(), timestamp=reminder["expires"])
         old.set_footer(text="Ended at")
         old.set_author(name=data["prize"])
@@ -299,19 +536,22 @@ class Giveaways(commands.Cog):
         elif len(winners) == 1:
             content = (
                 f"{random_tada()} Giveaway finished! "
-                f"{winners[0].mention}, you win the **{data['prize']}**! Congratulations! "
+                f"<@{winners[0]}>, you win the **{data['prize']}**! Congratulations! "
             )
-            old.description = f"Winner: {winners[0].mention}"
+            old.description = f"Winner: <@{winners[0]}>"
 
         else:
-            winners = ", ".join(w.mention for w in winners)
+            winners = ", ".join(f"<@{w}>" for w in winners)
             content = f"{random_tada()} Giveaway ended! Winners: {winners} You all win the **{data['prize']}**! :tada:"
             old.description = f"Winners: {winners}"
 
         new_kwargs = {"content": content}
 
-        await message.edit(**old_kwargs)
-        await message.reply(**new_kwargs)
+        try:
+            await message.edit(**old_kwargs)
+            await message.reply(**new_kwargs)
+        except discord.HTTPException:
+            return
 
 
 def setup(bot: core.CustomBot):
@@ -42,32 +42,13 @@ class Interactions(commands.Cog):
         return file, embed
 
     async def get_totals(self, method: str, initiator: discord.User, receiver: discord.User) -> dict:
-        query = """
-            SELECT
-                users.interactions.count AS amount, users.totals.count AS total
-            FROM
-               users.interactions
-            INNER JOIN
-                users.totals
-                ON users.interactions.receiver = users.totals.snowflake
-            WHERE
-                initiator = $1 AND receiver = $2 AND users.interactions.method = $3 AND users.totals.method = $3
-            """
-        data = dict(await self.bot.pool.fetchrow(query, initiator.id, receiver.id, method))
+        totals = self.bot.pool.prepared("interactions.totals")
+        data = dict(await totals.fetchrow(initiator.id, receiver.id, method))
         data.update({"user": receiver.display_name})
         return data
 
     async def update(self, method: str, initiator: discord.User, receiver: discord.User):
-        query = """
-            WITH total_update AS (
-                INSERT INTO users.totals (method, snowflake) VALUES ($1, $3)
-                ON CONFLICT (method, snowflake) DO UPDATE SET count = totals.count + 1
-            )
-            INSERT INTO users.interactions (method, initiator, receiver) VALUES ($1, $2, $3)
-            ON CONFLICT (method, initiator, receiver) DO UPDATE
-            SET count = interactions.count + 1
-            """
-        await self.bot.pool.execute(query, method, initiator.id, receiver.id)
+        await self.bot.pool.prepared("interactions.update").execute(method, initiator.id, receiver.id)
 
     def invoke_check(self, verb: str, initiator: discord.User, receiver: discord.User):
         if initiator == receiver:
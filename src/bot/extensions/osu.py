@@ -64,9 +64,7 @@ OsuConverterResponse = NamedTuple("ConverterResponse", [("search", Union[int, st
 class OsuUserConverter(commands.Converter):
     async def convert(self, ctx: "core.CustomContext", argument) -> OsuConverterResponse:
         if argument is None:
-            _id = await ctx.bot.pool.fetchval(
-                "SELECT id FROM users.games WHERE game = 'osu' AND snowflake = $1", ctx.author.id
-            )
+            _id = await ctx.bot.pool.prepared("osu.id").fetchval(ctx.author.id)
             if _id is None:
                 raise commands.BadArgument("You are not registered.")
             return OsuConverterResponse(search=_id, type="id")
@@ -74,9 +72,7 @@ class OsuUserConverter(commands.Converter):
             return OsuConverterResponse(search=str(url_match["id"]), type="id")
         if mention_match := MENTION_REGEX.fullmatch(argument):
             snowflake = int(mention_match["id"])
-            _id = await ctx.bot.pool.fetchval(
-                "SELECT id FROM users.games WHERE game = 'osu' AND snowflake = $1", snowflake
-            )
+            _id = await ctx.bot.pool.prepared("osu.id").fetchval(snowflake)
             if _id is None:
                 raise commands.BadArgument(
                     "That user is not registered." if _id != ctx.author.id else "You are not registered."
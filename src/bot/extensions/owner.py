@@ -4,6 +4,7 @@ import contextlib
 import inspect
 import io
 import textwrap
+import time
 import traceback
 
 import asyncpg
@@ -60,7 +61,8 @@ async def send(ctx: core.CustomContext, result, stdout_):
 class Owner(commands.Cog, command_attrs=dict(hidden=True)):
     def __init__(self, bot: core.CustomBot):
         self.bot = bot
-        self.pool = self.bot.pool
+        # ad-hoc queries can be slow, keep them away from command handling
+        self.pool = self.bot.pool.workload("analytics")
 
     async def cog_check(self, ctx):
         return await self.bot.is_owner(ctx.author)
@@ -153,6 +155,28 @@ class Owner(commands.Cog, command_attrs=dict(hidden=True)):
                 value = stdout.getvalue()
                 return await ctx.send(f"```py\n{value}{exception}```"[:1990])
 
+    @core.command(name="liveusage", aliases=("hitters",))
+    async def live_usage(self, ctx: core.CustomContext):
+        """Who is using the bot the most right now, from the live usage sketches."""
+        summary = self.bot.usage.summary()
+        names = {
+            "users": lambda user_id: str(self.bot.get_user(user_id) or user_id),
+            "guilds": lambda guild_id: str(self.bot.get_guild(guild_id) or guild_id),
+        }
+
+        embed = self.bot.embed(title="Live usage")
+        for name in ("commands", "users", "guilds"):
+            lines = [
+                f"{names.get(name, str)(entry['id'])} - {entry['count']:,.1f} (±{entry['error']:,.1f})"
+                + (f", {entry['unique_users']:,} users today" if "unique_users" in entry else "")
+                for entry in summary[name]
+            ]
+            embed.add_field(name=f"Top {name}", value="\n".join(lines) or "Nothing yet", inline=False)
+
+        days = "\n".join(f"{day}: ~{count:,}" for day, count in summary["unique_users"].items())
+        embed.add_field(name="Unique users per day", value=days or "Nothing yet", inline=False)
+        await ctx.send(embed=embed)
+
     @core.group()
     async def sql(self, ctx: core.CustomContext):
         if not ctx.invoked_subcommand:
@@ -179,6 +203,43 @@ class Owner(commands.Cog, command_attrs=dict(hidden=True)):
             ret = await self.pool.fetchval(query.strip("`"))
         await ctx.send(f"{codeblock(f'{ret!r}')}\n**Retrieved in {timer.exact}**")
 
+    @sql.command(name="stats", aliases=("s",))
+    async def sql_stats(self, ctx: core.CustomContext, sort: str = "total"):
+        """Timings in milliseconds per query, sorted by total, calls, mean, p50, p95, p99 or max."""
+        rows = self.pool.query_stats.summary(sort=sort.lower(), limit=15)
+        if not rows:
+            return await ctx.send("No queries have been recorded yet.")
+        for row in rows:
+            row["query"] = textwrap.shorten(row["query"], 60, placeholder="...")
+        table = tabulate(rows, headers="keys", tablefmt="github")
+        if len(table) > 1900:
+            table = await self.bot.paste(table)
+        await ctx.send(codeblock(table, lang=""))
+
+    @sql.command(aliases=("p",))
+    async def pools(self, ctx: core.CustomContext):
+        """Connections and acquire wait in milliseconds per workload pool."""
+        rows = [{"pool": name, **stats} for name, stats in self.pool.stats().items()]
+        table = tabulate(rows, headers="keys", tablefmt="github")
+        await ctx.send(codeblock(table, lang=""))
+
+    @sql.command(aliases=("sl",))
+    async def slow(self, ctx: core.CustomContext):
+        stats = self.pool.query_stats
+        if not stats.slow:
+            return await ctx.send("No slow queries have been recorded.")
+        table = tabulate(
+            (
+                (time.strftime("%H:%M:%S", time.gmtime(at)), f"{duration * 1000:.2f}", query)
+                for query, duration, at in reversed(stats.slow)
+            ),
+            headers=("at (UTC)", "ms", "query"),
+            tablefmt="github",
+        )
+        if len(table) > 1900:
+            table = await self.bot.paste(table)
+        await ctx.send(f"**Threshold: {stats.slow_threshold * 1000:.0f}ms**\n{codeblock(table, lang='')}")
+
     @sql.error
     async def sql_error(self, ctx: core.CustomContext, error: Exception):
         if isinstance(error, commands.CommandInvokeError):
@@ -1,12 +1,16 @@
 import asyncio
+import heapq
 import logging
-from datetime import datetime as dt, timedelta
+from datetime import datetime as dt, timedelta, timezone
 from json import dumps, loads
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import uuid4
 
 import asyncpg
 import discord
 from discord.ext import commands
 
+import config
 from .. import core
 from utils.time import human_timedelta, parse_time, utcnow
 
@@ -14,6 +18,26 @@ __all__ = ("setup",)
 
 log = logging.getLogger(__name__)
 
+# how far ahead, and how many, timers are kept in memory
+WINDOW = timedelta(days=10)
+WINDOW_SIZE = 5000
+# a truncated window is reloaded once fewer than this many timers are left in it
+LOW_WATERMARK = 500
+# how many due timers are claimed per round trip
+CLAIM_BATCH = 500
+# how long a claimed timer stays reserved for the process that claimed it
+LEASE = timedelta(seconds=60)
+# longest wait, in seconds, before the dispatcher retries after an error
+MAX_BACKOFF = 60
+
+DISPATCH_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    discord.ConnectionClosed,
+    asyncpg.PostgresError,
+    asyncpg.InterfaceError,
+)
+
 
 class Reminders(commands.Cog):
     def __init__(self, bot: core.CustomBot):
@@ -21,87 +45,228 @@ class Reminders(commands.Cog):
         self.emoji = "<a:pikawink:853236064991182909>"
         self.show_subcommands = True
 
-        self._current_timer = None
+        # (expires, id) of upcoming timers, every timer expiring before self._horizon is in here
+        self._heap: List[Tuple[dt, int]] = []
+        # ids in the heap, so a timer both loaded and announced by NOTIFY is only in there once
+        self._heap_ids: Set[int] = set()
+        self._horizon: Optional[dt] = None
+        self._truncated = False
+        # NOTIFYs received while load_window is fetching, added to the heap it builds
+        self._pending: Optional[List[Tuple[dt, int]]] = None
         self._event = asyncio.Event(loop=self.bot.loop)
 
+        # identifies the leases taken by this process
+        self.dispatcher_id = uuid4().hex
+        # dedicated connection receiving NOTIFYs for timers inserted by any process
+        self._listener: Optional[asyncpg.Connection] = None
+        # timers shorter than config.short_timer_threshold never touch the database
+        self._short_timers: Dict[asyncio.TimerHandle, dict] = {}
+
         self._task = self.bot.loop.create_task(self._reminder_dispatch())
 
-    async def get_active_reminder(self, days: int = 10, *, connection=None):
+    def cog_unload(self):
+        self._task.cancel()
+        if self._listener is not None:
+            self.bot.loop.create_task(self._listener.close())
+        if self._short_timers:
+            self.bot.loop.create_task(self.persist_short_timers())
+
+    async def listen(self):
+        self._listener = await asyncpg.connect(config.postgres_uri)
+        await self._listener.add_listener("timers", self._on_timer_notify)
+        # wake the dispatcher so it reconnects instead of sleeping through missed notifications
+        self._listener.add_termination_listener(lambda _: self._event.set())
+        # anything inserted while we weren't listening is picked up by a reload
+        self._horizon = None
+
+    def _on_timer_notify(self, _connection, _pid, _channel, payload: str):
+        timer = loads(payload)
+        self.schedule(dt.fromtimestamp(timer["expires"], timezone.utc), timer["id"])
+
+    def schedule(self, expires: dt, timer_id: int):
+        """Adds a freshly inserted timer to the heap, waking the dispatcher if it is the new head."""
+        if self._pending is not None:
+            # the window is being reloaded, the fetch may or may not see this timer
+            self._pending.append((expires, timer_id))
+            return
+
+        if self._horizon is None or expires >= self._horizon or timer_id in self._heap_ids:
+            return
+
+        heapq.heappush(self._heap, (expires, timer_id))
+        self._heap_ids.add(timer_id)
+        if self._heap[0][1] == timer_id:
+            self._event.set()
+
+    async def load_window(self):
+        """Loads the upcoming timers into the heap.
+
+        At most WINDOW_SIZE timers expiring within WINDOW are loaded. If the window was cut short,
+        the horizon is moved back to the last timer that was loaded.
+        """
         query = """
-            SELECT * 
-            FROM 
+            SELECT
+                id, expires
+            FROM
                 events.timers
             WHERE
-                expires < (CURRENT_DATE + $1::interval) 
+                expires < $1
             ORDER BY
-                expires 
+                expires
             LIMIT
-                1
+                $2
             """
-        conn = connection or self.bot.pool
-
-        ret = await conn.fetchrow(query, timedelta(days=days))
-        return ret or None
-
-    async def wait_for_reminders(self, *, days=10):
-        async with self.bot.pool.acquire() as conn:
-            reminder = await self.get_active_reminder(days, connection=conn)
-            if reminder is not None:
-                self._event.set()
-                return reminder
-
-            self._event.clear()
+        horizon = utcnow() + WINDOW
+        self._pending = []
+        try:
+            rows = await self.bot.pool.workload("background").fetch(query, horizon, WINDOW_SIZE)
+        finally:
+            pending, self._pending = self._pending, None
+
+        self._truncated = len(rows) == WINDOW_SIZE
+        self._horizon = rows[-1]["expires"] if self._truncated else horizon
+        self._heap = [(row["expires"], row["id"]) for row in rows]
+        self._heap_ids = {row["id"] for row in rows}
+        heapq.heapify(self._heap)
+
+        for expires, timer_id in pending:
+            self.schedule(expires, timer_id)
+
+    def needs_reload(self) -> bool:
+        if self._horizon is None or self._horizon <= utcnow():
+            return True
+        return self._truncated and len(self._heap) < LOW_WATERMARK
+
+    async def wait_until(self, when: dt):
+        """Sleeps until `when`, or until a new timer is scheduled in front of the heap."""
+        self._event.clear()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=(when - utcnow()).total_seconds())
+        except asyncio.TimeoutError:
+            pass
 
-            self._current_timer = None
+    async def claim_timers(self, now: dt) -> list:
+        """Leases a batch of due timers to this process.
 
-            await self._event.wait()
+        Rows locked or leased by another process are skipped, so several dispatchers can share
+        the table without firing a timer twice. A lease that is never released (because the
+        process died) runs out after LEASE and the timer is claimed again.
+        """
+        # dispatching is background work, it shouldn't take connections or timeouts from commands
+        claim = self.bot.pool.workload("background").prepared("timers.claim")
+        return await claim.fetch(now, CLAIM_BATCH, LEASE, self.dispatcher_id)
 
-            return await self.get_active_reminder(days, connection=conn)
+    async def release_timers(self, timers: list):
+        release = self.bot.pool.workload("background").prepared("timers.release")
+        await release.execute([timer["id"] for timer in timers], self.dispatcher_id)
 
-    async def call_timer(self, reminder):
-        await self.bot.pool.execute("DELETE FROM events.timers WHERE id = $1", reminder["id"])
+    def call_timer(self, reminder):
         reminder = dict(reminder)
         reminder["data"] = loads(reminder["data"])
 
         self.bot.dispatch(f"{reminder['event']}_complete", reminder)
 
+    async def dispatch_due(self):
+        now = utcnow()
+        timers = await self.claim_timers(now)
+
+        due = set()
+        while self._heap and self._heap[0][0] <= now:
+            _, timer_id = heapq.heappop(self._heap)
+            # id 0 is the retry entry pushed below, not a timer
+            if timer_id:
+                self._heap_ids.discard(timer_id)
+                due.add(timer_id)
+
+        # every listener runs in its own task, so the batch is handled concurrently
+        for timer in timers:
+            self.call_timer(timer)
+
+        if timers:
+            await self.release_timers(timers)
+
+        if len(timers) == CLAIM_BATCH:
+            # there may be more due timers than fit in one batch, make sure they get picked up
+            self._horizon = None
+        elif due - {timer["id"] for timer in timers}:
+            # another process holds some of these, look again once its lease could have run out
+            heapq.heappush(self._heap, (now + LEASE, 0))
+
+    async def dispatch_next(self):
+        if self._listener is None or self._listener.is_closed():
+            await self.listen()
+
+        if self.needs_reload():
+            await self.load_window()
+
+        if not self._heap:
+            await self.wait_until(self._horizon)
+        elif (expires := self._heap[0][0]) > utcnow():
+            await self.wait_until(expires)
+        else:
+            await self.dispatch_due()
+
     async def _reminder_dispatch(self):
         await self.bot.wait_until_ready()
-        try:
-            while not self.bot.is_closed():
-                reminder = self._current_timer = await self.wait_for_reminders()
+        backoff = 0
+        while not self.bot.is_closed():
+            try:
+                await self.dispatch_next()
+            except DISPATCH_ERRORS as exc:
+                backoff = min(backoff * 2 or 1, MAX_BACKOFF)
+                log.warning(f"Timer dispatch failed, retrying in {backoff}s: {exc!r}")
+                # NOTIFYs may have been missed meanwhile, so the window is loaded again
+                self._horizon = None
+                await asyncio.sleep(backoff)
+            else:
+                backoff = 0
+
+    def _call_short_timer(self, handle: asyncio.TimerHandle):
+        timer = self._short_timers.pop(handle, None)
+        if timer is not None:
+            self.bot.dispatch(f"{timer['event']}_complete", timer)
+
+    async def persist_short_timers(self):
+        """Writes every pending in-memory timer to the database in one batch, e.g. before shutting down."""
+        timers, self._short_timers = self._short_timers, {}
+        if not timers:
+            return
 
-                if (expires := reminder["expires"]) >= (now := utcnow()):
-                    to_sleep = (expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
+        for handle in timers:
+            handle.cancel()
 
-                await self.call_timer(reminder)
-        except asyncio.CancelledError:
-            raise
-        except (OSError, discord.ConnectionClosed, asyncpg.PostgresConnectionError):
-            # re-run the loop
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self._reminder_dispatch())
+        records = [(t["event"], t["created"], t["expires"], dumps(t["data"])) for t in timers.values()]
+        try:
+            async with self.bot.pool.workload("background").acquire() as conn:
+                await conn.copy_records_to_table(
+                    "timers",
+                    schema_name="events",
+                    columns=("event", "created", "expires", "data"),
+                    records=records,
+                )
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as exc:
+            # nowhere left to keep them, so they are logged in full to be recreated by hand
+            lines = "\n".join(
+                dumps({"event": event, "created": str(created), "expires": str(expires), "data": loads(data)})
+                for event, created, expires, data in records
+            )
+            log.error(f"Could not persist {len(records)} short timers: {exc!r}\n{lines}")
+            return
+        log.info(f"Persisted {len(records)} short timers.")
 
     async def create_timer(self, event: str, created: dt, expires: dt, data: dict):
-        query = """
-            INSERT INTO
-                events.timers (event, created, expires, data)
-            VALUES 
-                ($1, $2, $3, $4::JSONB)
-            RETURNING * 
-            """
-        values = (event, created, expires, dumps(data))
-        timer = await self.bot.pool.fetchrow(query, *values)
-
-        delta = (expires - created).total_seconds()
-
-        if delta <= (86400 * 10):
-            self._event.set()
-
-        if self._current_timer and expires < self._current_timer["expires"]:
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self._reminder_dispatch())
+        delay = (expires - utcnow()).total_seconds()
+        if delay < config.short_timer_threshold:
+            timer = {"id": None, "event": event, "created": created, "expires": expires, "data": data}
+            handle = self.bot.loop.call_later(max(delay, 0), lambda: self._call_short_timer(handle))
+            self._short_timers[handle] = timer
+            return timer
+
+        timer = await self.bot.pool.prepared("timers.insert").fetchrow(event, created, expires, dumps(data))
+
+        if self._listener is None or self._listener.is_closed():
+            # otherwise the NOTIFY sent by the insert schedules it
+            self.schedule(expires, timer["id"])
 
         return timer
 
@@ -0,0 +1,352 @@
+import heapq
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime as dt, timedelta, timezone
+from typing import Dict, List, Literal, Optional, Tuple
+
+import discord
+from discord.ext import commands
+
+from .. import core
+
+__all__ = ("setup",)
+
+log = logging.getLogger(__name__)
+
+# guild id used for the usage of every guild and DMs combined
+GLOBAL = 0
+
+# windows served from memory, in hours. anything longer comes from the all time tables
+WINDOWS = {"24h": 24, "day": 24, "7d": 168, "week": 168, "all": None}
+# how long all time results are reused for
+ALL_TIME_TTL = 60
+
+
+def parse_window(argument: str) -> Optional[int]:
+    try:
+        return WINDOWS[argument.lower()]
+    except KeyError:
+        raise commands.BadArgument(f"Window must be one of {', '.join(WINDOWS)}.") from None
+
+
+def window_name(hours: Optional[int]) -> str:
+    return {24: "the last 24 hours", 168: "the last 7 days", None: "all time"}[hours]
+
+
+class Window:
+    def __init__(self, hours: int):
+        self.hours = hours
+        # scope -> (command, failed) -> uses, and scope -> author -> uses
+        self.commands: Dict[int, Counter] = defaultdict(Counter)
+        self.users: Dict[int, Counter] = defaultdict(Counter)
+
+    def update(self, commands_: Counter, users: Counter, sign: int):
+        for (guild, command, failed), uses in commands_.items():
+            for scope in (GLOBAL,) if guild is None else (GLOBAL, guild):
+                self.commands[scope][command, failed] += sign * uses
+        for (guild, author), uses in users.items():
+            for scope in (GLOBAL,) if guild is None else (GLOBAL, guild):
+                self.users[scope][author] += sign * uses
+
+        if sign < 0:
+            for counters in (self.commands, self.users):
+                for scope, counter in list(counters.items()):
+                    # drops keys that reached zero, then scopes that are left empty
+                    counter += Counter()
+                    if not counter:
+                        del counters[scope]
+
+
+class HotWindow:
+    """Command usage over the last day and week, kept in memory in hourly buckets.
+
+    Every window keeps running totals per guild, which buckets are added to as commands come in and
+    subtracted from as they fall out of the window, so reading a window never sums the buckets.
+    """
+
+    def __init__(self, windows=(24, 168)):
+        self.windows = [Window(hours) for hours in windows]
+        self.buckets: Dict[int, Tuple[Counter, Counter]] = {}
+        self.current = 0
+
+    def advance(self, hour: int):
+        if hour <= self.current:
+            return
+        for window in self.windows:
+            for bucket, counters in self.buckets.items():
+                if self.current - window.hours < bucket <= hour - window.hours:
+                    window.update(*counters, -1)
+        self.current = hour
+
+        oldest = hour - max(window.hours for window in self.windows)
+        for bucket in [bucket for bucket in self.buckets if bucket <= oldest]:
+            del self.buckets[bucket]
+
+    def add(self, hour: int, commands_: Counter, users: Counter):
+        """Adds the uses of one hour, keyed by (guild, command, failed) and (guild, author)."""
+        self.advance(hour)
+        if hour <= self.current - max(window.hours for window in self.windows):
+            return
+
+        bucket_commands, bucket_users = self.buckets.setdefault(hour, (Counter(), Counter()))
+        bucket_commands.update(commands_)
+        bucket_users.update(users)
+        for window in self.windows:
+            if hour > self.current - window.hours:
+                window.update(commands_, users, 1)
+
+    def window(self, hours: int) -> Window:
+        self.advance(hour_of(dt.now(timezone.utc)))
+        return next(window for window in self.windows if window.hours == hours)
+
+
+def hour_of(when: dt) -> int:
+    if when.tzinfo is None:
+        # stats.commands.used is naive UTC
+        when = when.replace(tzinfo=timezone.utc)
+    return int(when.timestamp() // 3600)
+
+
+class Stats(commands.Cog):
+    """Command usage statistics"""
+
+    def __init__(self, bot: core.CustomBot):
+        self.bot = bot
+        self.emoji = "\N{CHART WITH UPWARDS TREND}"
+
+        self.hot = HotWindow()
+        self._all_time: Dict[tuple, Tuple[float, object]] = {}
+        # commands before this were already written to the database and are seeded from there
+        self.loaded_at = dt.now(timezone.utc)
+        self._seed = self.bot.loop.create_task(self.seed())
+
+    def cog_unload(self):
+        self._seed.cancel()
+
+    async def seed(self):
+        """Fills the hot window from the hourly rollups of the last week, once when loaded.
+
+        The rollups can't tell the commands from before loading apart from the ones counted live since,
+        so the hour the cog was loaded in is counted from the raw rows of that hour instead.
+        """
+        await self.bot.prepped.wait()
+        end = self.loaded_at.replace(tzinfo=None)
+        current = end.replace(minute=0, second=0, microsecond=0)
+        start = current - timedelta(hours=max(window.hours for window in self.hot.windows))
+
+        pool = self.bot.pool.workload("background")
+        command_rows = await pool.fetch(
+            """
+            SELECT
+                hour, guild, command, failed, count
+            FROM
+                stats.commands_hourly
+            WHERE
+                hour >= $1 AND hour < $2
+            UNION ALL
+            SELECT
+                $2::TIMESTAMP, COALESCE(guild, 0), command, COALESCE(failed, FALSE), COUNT(*)
+            FROM
+                stats.commands
+            WHERE
+                used >= $2 AND used < $3
+            GROUP BY
+                2, 3, 4
+            """,
+            start,
+            current,
+            end,
+        )
+        user_rows = await pool.fetch(
+            """
+            SELECT
+                hour, guild, author, count
+            FROM
+                stats.users_hourly
+            WHERE
+                hour >= $1 AND hour < $2
+            UNION ALL
+            SELECT
+                $2::TIMESTAMP, COALESCE(guild, 0), author, COUNT(*)
+            FROM
+                stats.commands
+            WHERE
+                used >= $2 AND used < $3
+            GROUP BY
+                2, 3
+            """,
+            start,
+            current,
+            end,
+        )
+
+        # the rollups keep DMs under guild 0, the hot window under None
+        hours: Dict[int, Tuple[Counter, Counter]] = defaultdict(lambda: (Counter(), Counter()))
+        for row in command_rows:
+            key = (row["guild"] or None, row["command"], row["failed"])
+            hours[hour_of(row["hour"])][0][key] += row["count"]
+        for row in user_rows:
+            hours[hour_of(row["hour"])][1][row["guild"] or None, row["author"]] += row["count"]
+        for hour, (commands_, users) in sorted(hours.items()):
+            self.hot.add(hour, commands_, users)
+
+        log.info(f"Seeded command usage for {len(hours)} hours.")
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx: core.CustomContext):
+        if ctx.command is None:
+            return
+
+        guild = getattr(ctx.guild, "id", None)
+        self.hot.add(
+            hour_of(ctx.message.created_at),
+            Counter({(guild, ctx.command.qualified_name, bool(ctx.command_failed)): 1}),
+            Counter({(guild, ctx.author.id): 1}),
+        )
+
+    async def all_time(self, key: tuple, query: str, *args) -> list:
+        cached = self._all_time.get(key)
+        if cached is not None and time.monotonic() - cached[0] < ALL_TIME_TTL:
+            return cached[1]
+
+        rows = await self.bot.pool.workload("analytics").fetch(query, *args)
+        now = time.monotonic()
+        # one entry per kind and guild asked about, so drop the expired ones instead of keeping every guild
+        for stale in [
+            key for key, (cached_at, _) in self._all_time.items() if now - cached_at >= ALL_TIME_TTL
+        ]:
+            del self._all_time[stale]
+        self._all_time[key] = (now, rows)
+        return rows
+
+    async def top_commands(self, scope: int, hours: Optional[int], limit: int = 10) -> List[Tuple[str, int]]:
+        if hours is None:
+            query = (
+                "SELECT command, uses FROM stats.command_totals WHERE guild = $1 ORDER BY uses DESC LIMIT $2"
+            )
+            return [tuple(row) for row in await self.all_time(("commands", scope), query, scope, limit)]
+
+        uses = Counter()
+        for (command, _), count in self.hot.window(hours).commands.get(scope, {}).items():
+            uses[command] += count
+        return uses.most_common(limit)
+
+    async def top_users(self, scope: int, hours: Optional[int], limit: int = 10) -> List[Tuple[int, int]]:
+        if hours is None:
+            query = "SELECT author, uses FROM stats.user_totals WHERE guild = $1 ORDER BY uses DESC LIMIT $2"
+            return [tuple(row) for row in await self.all_time(("users", scope), query, scope, limit)]
+
+        users = self.hot.window(hours).users.get(scope, Counter())
+        return heapq.nlargest(limit, users.items(), key=lambda item: item[1])
+
+    async def failures(self, scope: int, hours: Optional[int]) -> Dict[str, Tuple[int, int]]:
+        """Uses and failures per command, as (uses, failures) pairs."""
+        if hours is None:
+            query = "SELECT command, uses, failures FROM stats.command_totals WHERE guild = $1"
+            rows = await self.all_time(("failures", scope), query, scope)
+            return {row["command"]: (row["uses"], row["failures"]) for row in rows}
+
+        counts = defaultdict(lambda: [0, 0])
+        for (command, failed), count in self.hot.window(hours).commands.get(scope, {}).items():
+            counts[command][0] += count
+            if failed:
+                counts[command][1] += count
+        return {command: tuple(pair) for command, pair in counts.items()}
+
+    def scope_of(self, ctx: core.CustomContext, scope: str) -> Tuple[int, str]:
+        if scope == "global" or ctx.guild is None:
+            return GLOBAL, "everywhere"
+        return ctx.guild.id, ctx.guild.name
+
+    @core.group(
+        name="stats",
+        aliases=("usage",),
+        examples=("", "7d", "global", "all global"),
+        params={
+            "window": "24h, 7d or all. Defaults to 24h, and can be left out before the scope.",
+            "scope": "here for this server, global for every server. Defaults to here.",
+        },
+        returns="The most used commands.",
+        invoke_without_command=True,
+    )
+    async def stats(
+        self,
+        ctx: core.CustomContext,
+        window: Optional[parse_window] = 24,
+        scope: Literal["here", "global"] = "here",
+    ):
+        await self.stats_commands(ctx, window, scope)
+
+    @stats.command(
+        name="commands",
+        aliases=("cmds",),
+        examples=("7d", "global", "all global"),
+        returns="The most used commands.",
+    )
+    async def stats_commands(
+        self,
+        ctx: core.CustomContext,
+        window: Optional[parse_window] = 24,
+        scope: Literal["here", "global"] = "here",
+    ):
+        guild, where = self.scope_of(ctx, scope)
+        top = await self.top_commands(guild, window)
+        lines = [f"`{i}.` **{command}** - {uses:,} uses" for i, (command, uses) in enumerate(top, start=1)]
+        embed = self.bot.embed(
+            title=f"Top commands {where}, {window_name(window)}",
+            description="\n".join(lines) or "No commands have been used.",
+        )
+        await ctx.send(embed=embed)
+
+    @stats.command(
+        name="users",
+        aliases=("members",),
+        examples=("7d", "global", "all global"),
+        returns="The most active users.",
+    )
+    async def stats_users(
+        self,
+        ctx: core.CustomContext,
+        window: Optional[parse_window] = 24,
+        scope: Literal["here", "global"] = "here",
+    ):
+        guild, where = self.scope_of(ctx, scope)
+        top = await self.top_users(guild, window)
+        lines = [f"`{i}.` <@{author}> - {uses:,} commands" for i, (author, uses) in enumerate(top, start=1)]
+        embed = self.bot.embed(
+            title=f"Most active users {where}, {window_name(window)}",
+            description="\n".join(lines) or "No commands have been used.",
+        )
+        await ctx.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
+    @stats.command(
+        name="failures",
+        aliases=("errors",),
+        examples=("7d", "global", "all global"),
+        returns="How often commands fail.",
+    )
+    async def stats_failures(
+        self,
+        ctx: core.CustomContext,
+        window: Optional[parse_window] = 24,
+        scope: Literal["here", "global"] = "here",
+    ):
+        guild, where = self.scope_of(ctx, scope)
+        counts = await self.failures(guild, window)
+        uses = sum(pair[0] for pair in counts.values())
+        failed = sum(pair[1] for pair in counts.values())
+
+        worst = sorted(((f, u, c) for c, (u, f) in counts.items() if f), reverse=True)[:5]
+        lines = [f"**{command}** - {f:,} of {u:,} failed ({f / u:.1%})" for f, u, command in worst]
+        embed = self.bot.embed(
+            title=f"Failure rate {where}, {window_name(window)}",
+            description=f"{failed:,} of {uses:,} commands failed ({failed / uses if uses else 0:.2%})",
+        )
+        if lines:
+            embed.add_field(name="Failed most", value="\n".join(lines))
+        await ctx.send(embed=embed)
+
+
+def setup(bot: core.CustomBot):
+    bot.add_cog(Stats(bot))
@@ -6,6 +6,14 @@ __all__ = (
     "token",
     "prefix",
     "postgres_uri",
+    "spool_path",
+    "short_timer_threshold",
+    "ipc_path",
+    "slow_query_threshold",
+    "pools",
+    "replicas",
+    "replica_max_lag",
+    "command_retention_months",
     "osu",
     "twitter_bearer_token",
     "finnhub_key",
@@ -19,6 +27,14 @@ with open("config.yml") as f:
 token = _config["token"]
 prefix = _config["prefix"]
 postgres_uri = _config["postgres_uri"]
+spool_path = _config.get("spool_path", "stats.spool")
+short_timer_threshold = _config.get("short_timer_threshold", 120)
+ipc_path = _config.get("ipc_path")
+slow_query_threshold = _config.get("slow_query_threshold", 0.25)
+pools = _config.get("pools", {})
+replicas = _config.get("replicas", [])
+replica_max_lag = _config.get("replica_max_lag", 5)
+command_retention_months = _config.get("command_retention_months", 12)
 
 _keys = _config["keys"]
 
@@ -1,12 +1,163 @@
-from asyncpg import Connection, Pool, Record
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence
 
-__all__ = ("CustomPool", "create_pool")
+from asyncpg import Connection, Pool, PostgresError, ReadOnlySQLTransactionError, Record
+from asyncpg.prepared_stmt import PreparedStatement
+
+from .replicas import REPLICA_ERRORS, PinnedTransaction, Replicas, is_read_only, mark_write, pinned
+from .statements import STATEMENTS
+from .stats import QueryStats
+from utils.histogram import Histogram
+
+__all__ = (
+    "CustomConnection",
+    "CustomPool",
+    "Prepared",
+    "QueryStats",
+    "Replicas",
+    "STATEMENTS",
+    "WORKLOADS",
+    "create_pool",
+)
+
+log = logging.getLogger("db")
+
+# every workload gets its own pool, so a slow analytical query can't hold up command handling.
+# statement_timeout is in seconds, None for no limit. read_replicas sends read-only queries to the
+# replicas when there are any, background stays on the primary as it mostly writes
+WORKLOADS = {
+    "interactive": {"min_size": 2, "max_size": 6, "statement_timeout": 5, "read_replicas": True},
+    "background": {"min_size": 1, "max_size": 2, "statement_timeout": 60, "read_replicas": False},
+    "analytics": {"min_size": 1, "max_size": 2, "statement_timeout": 30, "read_replicas": True},
+}
+
+# options of the pool opened for every replica, replicas are connected to lazily so a replica
+# that is down doesn't stop the bot from starting
+REPLICA_POOL = {"min_size": 0, "max_size": 4, "statement_timeout": 30}
+
+# statements that failed to prepare up front, so it is only logged once and not per connection
+_unprepared = set()
+
+
+class CustomConnection(Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, PreparedStatement] = {}
+
+    def transaction(self, **kwargs):
+        return PinnedTransaction(super().transaction(**kwargs))
+
+    # writes made on an acquired connection pin the task's reads to the primary, same as pool writes
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        if not is_read_only(query):
+            mark_write()
+        return await super().execute(query, *args, **kwargs)
+
+    async def executemany(self, command: str, args, **kwargs):
+        mark_write()
+        return await super().executemany(command, args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs) -> list:
+        if not is_read_only(query):
+            mark_write()
+        return await super().fetch(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        if not is_read_only(query):
+            mark_write()
+        return await super().fetchval(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        if not is_read_only(query):
+            mark_write()
+        return await super().fetchrow(query, *args, **kwargs)
+
+    async def copy_to_table(self, table_name: str, **kwargs) -> str:
+        mark_write()
+        return await super().copy_to_table(table_name, **kwargs)
+
+    async def copy_records_to_table(self, table_name: str, **kwargs) -> str:
+        mark_write()
+        return await super().copy_records_to_table(table_name, **kwargs)
+
+    async def prepare_statements(self):
+        for name in STATEMENTS:
+            try:
+                await self.prepared(name)
+            except PostgresError as exc:
+                # e.g. a table from a migration that hasn't run yet. the connection is still usable,
+                # and the statement is prepared again (and fails loudly) when it is first used
+                if name not in _unprepared:
+                    _unprepared.add(name)
+                    log.warning(f"Could not prepare {name}, preparing it on first use: {exc!r}")
+
+    async def prepared(self, name: str) -> PreparedStatement:
+        statement = self.statements.get(name)
+        if statement is None:
+            statement = self.statements[name] = await self.prepare(STATEMENTS[name])
+        return statement
+
+
+class Prepared:
+    """A statement from STATEMENTS, run on whichever pooled connection is free."""
+
+    __slots__ = ("pool", "name")
+
+    def __init__(self, pool: "CustomPool", name: str):
+        self.pool = pool
+        self.name = name
+
+    async def _run(self, method: str, *args, status: bool = False, **kwargs):
+        # prepared statements always run on the primary, most of them write
+        if not is_read_only(STATEMENTS[self.name]):
+            mark_write()
+        async with self.pool.acquire() as con:
+            statement = await con.prepared(self.name)
+            with self.pool.timed(STATEMENTS[self.name]):
+                result = await getattr(statement, method)(*args, **kwargs)
+            # prepared statements have no execute, the status is read off the statement instead
+            return statement.get_statusmsg() if status else result
+
+    async def execute(self, *args, timeout: float = None) -> str:
+        self.pool.calls["EXECUTE"] += 1
+        return await self._run("fetch", *args, status=True, timeout=timeout)
+
+    async def fetch(self, *args, timeout: float = None) -> list:
+        self.pool.calls["FETCH"] += 1
+        return await self._run("fetch", *args, timeout=timeout)
+
+    async def fetchval(self, *args, column: int = 0, timeout: float = None):
+        self.pool.calls["FETCHVAL"] += 1
+        return await self._run("fetchval", *args, column=column, timeout=timeout)
+
+    async def fetchrow(self, *args, timeout: float = None):
+        self.pool.calls["FETCHROW"] += 1
+        return await self._run("fetchrow", *args, timeout=timeout)
 
 
 class CustomPool(Pool):
-    def __init__(self, bot, *args, **kwargs):
+    def __init__(
+        self,
+        bot,
+        *args,
+        name: str = "interactive",
+        pools: Optional[Dict[str, "CustomPool"]] = None,
+        query_stats: Optional[QueryStats] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.bot = bot
+        self.name = name
+        # shared by every workload pool, so each of them can reach the others
+        self.pools = pools if pools is not None else {}
+        self.pools[name] = self
+        self.query_stats = query_stats or QueryStats()
+        # seconds spent waiting for a free connection
+        self.acquire_wait = Histogram()
+        self.replicas: Optional[Replicas] = None
 
         self.cache = {}
         self.calls = {
@@ -17,30 +168,92 @@ class CustomPool(Pool):
             "FETCHROW": 0,
         }
 
+    def workload(self, name: str) -> "CustomPool":
+        return self.pools[name]
+
+    async def _acquire(self, timeout):
+        start = time.perf_counter()
+        try:
+            return await super()._acquire(timeout)
+        finally:
+            self.acquire_wait.record(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, dict]:
+        """Size and acquire wait (in milliseconds) of every workload pool."""
+        return {
+            name: {
+                "size": pool.get_size(),
+                "idle": pool.get_idle_size(),
+                "max": pool.get_max_size(),
+                "acquired": pool.acquire_wait.count,
+                **{
+                    f"p{p}": round(wait * 1000, 2)
+                    for p, wait in pool.acquire_wait.percentiles((50, 99)).items()
+                },
+                "max wait": round(pool.acquire_wait.max * 1000, 2),
+            }
+            for name, pool in self.pools.items()
+        }
+
+    async def close_all(self):
+        for pool in self.pools.values():
+            if pool.replicas is not None:
+                pool.replicas.close()
+        await asyncio.gather(*(pool.close() for pool in self.pools.values()))
+
+    def prepared(self, name: str) -> Prepared:
+        if name not in STATEMENTS:
+            raise KeyError(f"No statement named {name!r}")
+        return Prepared(self, name)
+
+    @contextmanager
+    def timed(self, query: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.query_stats.record(query, time.perf_counter() - start)
+
+    async def _query(self, method: str, query: str, *args, **kwargs):
+        async with self.acquire() as con:
+            with self.timed(query):
+                return await getattr(con, method)(query, *args, **kwargs)
+
+    async def _read(self, method: str, query: str, *args, **kwargs):
+        replicas = self.replicas
+        if replicas is not None and is_read_only(query) and not pinned(replicas.max_lag):
+            replica = replicas.choose()
+            if replica is not None:
+                try:
+                    return await replica._query(method, query, *args, **kwargs)
+                except REPLICA_ERRORS as exc:
+                    replicas.mark_down(replica, exc)
+                except ReadOnlySQLTransactionError:
+                    # the query writes after all, e.g. through a function
+                    pass
+        return await self._query(method, query, *args, **kwargs)
+
     async def execute(self, query: str, *args, timeout: float = None) -> str:
         self.calls["EXECUTE"] += 1
-        async with self.acquire() as con:
-            return await con.execute(query, *args, timeout=timeout)
+        mark_write()
+        return await self._query("execute", query, *args, timeout=timeout)
 
     async def executemany(self, command: str, args, *, timeout: float = None):
         self.calls["EXECUTEMANY"] += 1
-        async with self.acquire() as con:
-            return await con.executemany(command, args, timeout=timeout)
+        mark_write()
+        return await self._query("executemany", command, args, timeout=timeout)
 
     async def fetch(self, query, *args, timeout=None) -> list:
         self.calls["FETCH"] += 1
-        async with self.acquire() as con:
-            return await con.fetch(query, *args, timeout=timeout)
+        return await self._read("fetch", query, *args, timeout=timeout)
 
     async def fetchval(self, query, *args, column=0, timeout=None):
         self.calls["FETCHVAL"] += 1
-        async with self.acquire() as con:
-            return await con.fetchval(query, *args, column=column, timeout=timeout)
+        return await self._read("fetchval", query, *args, column=column, timeout=timeout)
 
     async def fetchrow(self, query, *args, timeout=None):
         self.calls["FETCHROW"] += 1
-        async with self.acquire() as con:
-            return await con.fetchrow(query, *args, timeout=timeout)
+        return await self._read("fetchrow", query, *args, timeout=timeout)
 
     async def register_user(self, game: str, snowflake: int, _id: str):
         query = """
@@ -74,24 +287,95 @@ class CustomPool(Pool):
         await self.execute(query, data)
 
 
-def create_pool(
+async def create_pool(
+    bot,
+    dsn=None,
+    *,
+    workloads: Optional[Dict[str, dict]] = None,
+    replicas: Sequence[str] = (),
+    replica_max_lag: float = 5.0,
+    slow_query_threshold=0.25,
+    **kwargs,
+) -> CustomPool:
+    """Opens a pool for every workload and returns the interactive one.
+
+    ``workloads`` overrides the options in WORKLOADS per workload name. The other pools are reached
+    with ``pool.workload(name)``. ``replicas`` are DSNs of read replicas that read-only queries
+    are spread over.
+    """
+    workloads = workloads or {}
+    query_stats = QueryStats(slow_threshold=slow_query_threshold)
+    pools = {}
+    try:
+        replica_pools = [
+            await _create_pool(
+                bot,
+                replica,
+                name=f"replica-{i}",
+                pools=pools,
+                query_stats=query_stats,
+                connection_class=Connection,
+                **{**kwargs, **REPLICA_POOL},
+            )
+            for i, replica in enumerate(replicas, start=1)
+        ]
+        routing = Replicas(replica_pools, max_lag=replica_max_lag) if replica_pools else None
+
+        for name in {**WORKLOADS, **workloads}:
+            options = {**WORKLOADS.get(name, {}), **workloads.get(name, {})}
+            read_replicas = options.pop("read_replicas", False)
+            pool = await _create_pool(
+                bot, dsn, name=name, pools=pools, query_stats=query_stats, **options, **kwargs
+            )
+            if read_replicas:
+                pool.replicas = routing
+    except BaseException:
+        await asyncio.gather(*(pool.close() for pool in pools.values()), return_exceptions=True)
+        raise
+
+    if routing is not None:
+        routing.start()
+    return pools["interactive"]
+
+
+def _create_pool(
     bot,
     dsn=None,
     *,
+    name,
+    pools,
+    query_stats,
     min_size=10,
     max_size=10,
+    statement_timeout=None,
     max_queries=50000,
     max_inactive_connection_lifetime=300.0,
     setup=None,
     init=None,
     loop=None,
-    connection_class=Connection,
+    connection_class=CustomConnection,
     record_class=Record,
     **connect_kwargs,
 ) -> CustomPool:
+    async def _init(conn):
+        # pays the parse and plan cost of the hot queries once per connection, up front
+        if isinstance(conn, CustomConnection):
+            await conn.prepare_statements()
+        if init is not None:
+            await init(conn)
+
+    if statement_timeout is not None:
+        connect_kwargs["server_settings"] = {
+            **connect_kwargs.get("server_settings", {}),
+            "statement_timeout": str(int(statement_timeout * 1000)),
+        }
+
     return CustomPool(
         bot,
         dsn,
+        name=name,
+        pools=pools,
+        query_stats=query_stats,
         connection_class=connection_class,
         record_class=record_class,
         min_size=min_size,
@@ -99,7 +383,7 @@ def create_pool(
         max_queries=max_queries,
         loop=loop,
         setup=setup,
-        init=init,
+        init=_init,
         max_inactive_connection_lifetime=max_inactive_connection_lifetime,
         **connect_kwargs,
     )
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+import asyncpg
+from asyncpg import Pool
+
+__all__ = ("Replicas", "PinnedTransaction", "is_read_only", "mark_write", "pinned", "REPLICA_ERRORS")
+
+log = logging.getLogger("db.replicas")
+
+# errors that mean a replica is unreachable, a read that hits one is retried on the primary
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+
+LAG_QUERY = """
+    SELECT
+        CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+        END
+    """
+
+_SELECT = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+_WRITES = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|MERGE|NEXTVAL|SETVAL|FOR\s+SHARE|FOR\s+KEY\s+SHARE)\b", re.IGNORECASE
+)
+
+# monotonic time of the last write made from this task, and whether it has a transaction open
+_last_write: ContextVar[float] = ContextVar("last_write", default=float("-inf"))
+_in_transaction: ContextVar[bool] = ContextVar("in_transaction", default=False)
+
+
+def is_read_only(query: str) -> bool:
+    return _SELECT.match(query) is not None and _WRITES.search(query) is None
+
+
+def mark_write():
+    _last_write.set(time.monotonic())
+
+
+def pinned(window: float) -> bool:
+    """Whether reads from the current task have to see its own writes, and so must go to the primary."""
+    return _in_transaction.get() or time.monotonic() - _last_write.get() < window
+
+
+class PinnedTransaction:
+    """Wraps a transaction so pool reads made while it is open stay on the primary."""
+
+    __slots__ = ("_transaction", "_token")
+
+    def __init__(self, transaction):
+        self._transaction = transaction
+        self._token = None
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+    async def __aenter__(self):
+        self._token = _in_transaction.set(True)
+        try:
+            return await self._transaction.__aenter__()
+        except BaseException:
+            _in_transaction.reset(self._token)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._transaction.__aexit__(*exc_info)
+        finally:
+            _in_transaction.reset(self._token)
+            mark_write()
+
+
+class Replicas:
+    """Round robin over read replica pools, skipping any that failed their last health check.
+
+    A replica counts as down when it can't be reached or is more than ``max_lag`` seconds behind.
+    Reads made within ``max_lag`` of a write from the same task skip the replicas, so a task
+    always sees its own writes.
+    """
+
+    def __init__(self, pools: List[Pool], *, max_lag: float = 5.0, interval: float = 10.0):
+        self.pools = pools
+        self.max_lag = max_lag
+        self.interval = interval
+
+        self.healthy: Dict[Pool, bool] = dict.fromkeys(pools, True)
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def choose(self) -> Optional[Pool]:
+        for _ in range(len(self.pools)):
+            pool = self.pools[self._next]
+            self._next = (self._next + 1) % len(self.pools)
+            if self.healthy[pool]:
+                return pool
+        return None
+
+    def mark_down(self, pool: Pool, reason):
+        if self.healthy[pool]:
+            log.warning(f"Read replica {pool.name} is down, reading from the primary instead: {reason!r}")
+        self.healthy[pool] = False
+
+    async def check(self, pool: Pool):
+        try:
+            async with pool.acquire(timeout=5) as con:
+                lag = await con.fetchval(LAG_QUERY, timeout=5)
+        except (*REPLICA_ERRORS, asyncpg.PostgresError) as exc:
+            self.mark_down(pool, exc)
+            return
+
+        if lag is not None and lag > self.max_lag:
+            self.mark_down(pool, f"{lag:.1f}s behind")
+        elif not self.healthy[pool]:
+            log.info(f"Read replica {pool.name} is back up")
+            self.healthy[pool] = True
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self.check(pool) for pool in self.pools))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,118 @@
+from typing import Dict
+
+__all__ = ("STATEMENTS",)
+
+# hot queries, prepared on every pooled connection as soon as it is opened. run them with pool.prepared(name)
+STATEMENTS: Dict[str, str] = {
+    "osu.id": "SELECT id FROM users.games WHERE game = 'osu' AND snowflake = $1",
+    "interactions.totals": """
+        SELECT
+            users.interactions.count AS amount, users.totals.count AS total
+        FROM
+           users.interactions
+        INNER JOIN
+            users.totals
+            ON users.interactions.receiver = users.totals.snowflake
+        WHERE
+            initiator = $1 AND receiver = $2 AND users.interactions.method = $3 AND users.totals.method = $3
+        """,
+    "interactions.update": """
+        WITH total_update AS (
+            INSERT INTO users.totals (method, snowflake) VALUES ($1, $3)
+            ON CONFLICT (method, snowflake) DO UPDATE SET count = totals.count + 1
+        )
+        INSERT INTO users.interactions (method, initiator, receiver) VALUES ($1, $2, $3)
+        ON CONFLICT (method, initiator, receiver) DO UPDATE
+        SET count = interactions.count + 1
+        """,
+    "timers.claim": """
+        UPDATE
+            events.timers
+        SET
+            leased_until = $1 + $3::INTERVAL, leased_by = $4
+        WHERE id IN (
+            SELECT
+                id
+            FROM
+                events.timers
+            WHERE
+                expires <= $1 AND (leased_until IS NULL OR leased_until < $1)
+            ORDER BY
+                expires
+            LIMIT
+                $2
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+        """,
+    "timers.release": "DELETE FROM events.timers WHERE id = ANY($1::INT[]) AND leased_by = $2",
+    "timers.insert": """
+        INSERT INTO
+            events.timers (event, created, expires, data)
+        VALUES
+            ($1, $2, $3, $4::JSONB)
+        RETURNING *
+        """,
+    "stats.commands_rollup": """
+        WITH counts AS (
+            SELECT * FROM UNNEST($1::TIMESTAMP[], $2::TEXT[], $3::BIGINT[], $4::BOOLEAN[], $5::BIGINT[])
+            AS c(hour, command, guild, failed, count)
+        ),
+        hourly AS (
+            INSERT INTO
+                stats.commands_hourly (hour, command, guild, failed, count)
+            SELECT * FROM counts
+            ON CONFLICT (hour, command, guild, failed)
+            DO UPDATE SET
+                count = commands_hourly.count + EXCLUDED.count
+        ),
+        daily AS (
+            INSERT INTO
+                stats.commands_daily (day, command, guild, failed, count)
+            SELECT hour::DATE, command, guild, failed, SUM(count) FROM counts GROUP BY 1, 2, 3, 4
+            ON CONFLICT (day, command, guild, failed)
+            DO UPDATE SET
+                count = commands_daily.count + EXCLUDED.count
+        )
+        INSERT INTO
+            stats.totals (name, count)
+        SELECT 'commands', SUM(count) FROM counts
+        UNION ALL
+        SELECT 'commands_failed', COALESCE(SUM(count) FILTER (WHERE failed), 0) FROM counts
+        ON CONFLICT (name)
+        DO UPDATE SET
+            count = totals.count + EXCLUDED.count
+        """,
+    "stats.users_rollup": """
+        INSERT INTO
+            stats.users_hourly (hour, guild, author, count)
+        SELECT * FROM UNNEST($1::TIMESTAMP[], $2::BIGINT[], $3::BIGINT[], $4::BIGINT[])
+        ON CONFLICT (hour, guild, author)
+        DO UPDATE SET
+            count = users_hourly.count + EXCLUDED.count
+        """,
+    "stats.command_totals": """
+        INSERT INTO
+            stats.command_totals (guild, command, uses, failures)
+        SELECT * FROM UNNEST($1::BIGINT[], $2::TEXT[], $3::BIGINT[], $4::BIGINT[])
+        ON CONFLICT (guild, command)
+        DO UPDATE SET
+            uses = command_totals.uses + EXCLUDED.uses, failures = command_totals.failures + EXCLUDED.failures
+        """,
+    "stats.user_totals": """
+        INSERT INTO
+            stats.user_totals (guild, author, uses)
+        SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[], $3::BIGINT[])
+        ON CONFLICT (guild, author)
+        DO UPDATE SET
+            uses = user_totals.uses + EXCLUDED.uses
+        """,
+    "stats.socket_upsert": """
+        INSERT INTO
+            stats.socket (name, count)
+        SELECT * FROM UNNEST($1::TEXT[], $2::BIGINT[])
+        ON CONFLICT (name)
+        DO UPDATE SET
+            count = socket.count + EXCLUDED.count
+        """,
+}
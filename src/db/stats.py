@@ -0,0 +1,92 @@
+import logging
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple
+
+from utils.histogram import Histogram
+
+__all__ = ("QueryStats", "SlowQuery", "normalise")
+
+log = logging.getLogger("db.slow")
+
+# queries past this many distinct shapes are lumped together, so ad-hoc SQL can't grow this forever
+MAX_QUERIES = 500
+OTHER = "<other>"
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise(query: str) -> str:
+    """Collapses whitespace and replaces literals, so the same query with different values groups together."""
+    query = _STRINGS.sub("?", query)
+    query = _NUMBERS.sub("?", query)
+    query = _LISTS.sub("(?)", query)
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+class SlowQuery(NamedTuple):
+    query: str
+    duration: float
+    at: float
+
+
+class QueryStats:
+    """Latency histograms per normalised query, plus a log of the recent slow ones."""
+
+    def __init__(self, *, slow_threshold: float = 0.25, slow_log_size: int = 50):
+        self.slow_threshold = slow_threshold
+
+        self.queries: Dict[str, Histogram] = {}
+        self.slow: Deque[SlowQuery] = deque(maxlen=slow_log_size)
+        self._normalised: Dict[str, str] = {}
+
+    def _key(self, query: str) -> str:
+        key = self._normalised.get(query)
+        if key is None:
+            key = normalise(query)
+            if len(self._normalised) < MAX_QUERIES * 4:
+                self._normalised[query] = key
+        return key
+
+    def record(self, query: str, duration: float):
+        key = self._key(query)
+        histogram = self.queries.get(key)
+        if histogram is None:
+            if len(self.queries) >= MAX_QUERIES:
+                key = OTHER
+                histogram = self.queries.get(OTHER)
+            if histogram is None:
+                histogram = self.queries[key] = Histogram()
+        histogram.record(duration)
+
+        if duration >= self.slow_threshold:
+            self.slow.append(SlowQuery(key, duration, time.time()))
+            log.warning(f"Slow query ({duration * 1000:.2f}ms): {key}")
+
+    def clear(self):
+        self.queries.clear()
+        self.slow.clear()
+
+    def summary(self, *, sort: str = "total", limit: int = 20) -> List[dict]:
+        """One dict per query with timings in milliseconds, sorted by ``sort`` descending."""
+        rows = []
+        for query, histogram in self.queries.items():
+            p50, p95, p99 = histogram.percentiles((50, 95, 99)).values()
+            rows.append(
+                {
+                    "query": query,
+                    "calls": histogram.count,
+                    "total": round(histogram.total * 1000, 2),
+                    "mean": round(histogram.mean * 1000, 2),
+                    "p50": round(p50 * 1000, 2),
+                    "p95": round(p95 * 1000, 2),
+                    "p99": round(p99 * 1000, 2),
+                    "max": round(histogram.max * 1000, 2),
+                }
+            )
+        rows.sort(key=lambda row: row.get(sort, 0), reverse=True)
+        return rows[:limit]
@@ -9,8 +9,7 @@ from asyncpg import Pool, create_pool
 
 import db
 from bot.core import CustomBot
-from config import postgres_uri, token
-
+from config import pools, postgres_uri, replica_max_lag, replicas, slow_query_threshold, token
 
 log = logging.getLogger("runner.bot")
 
@@ -24,7 +23,17 @@ def run():
     loop = asyncio.get_event_loop()
 
     bot = CustomBot(loop=loop)
-    bot.pool = loop.run_until_complete(db.create_pool(bot=bot, dsn=postgres_uri, loop=bot.loop))
+    bot.pool = loop.run_until_complete(
+        db.create_pool(
+            bot=bot,
+            dsn=postgres_uri,
+            loop=bot.loop,
+            workloads=pools,
+            replicas=replicas,
+            replica_max_lag=replica_max_lag,
+            slow_query_threshold=slow_query_threshold,
+        )
+    )
 
     bot.run(token)
 
@@ -0,0 +1,99 @@
+"""Compares the JSONB_TO_RECORDSET flush against the binary COPY flush used by BackgroundEvents.
+
+Usage (from src/): python -m scripts.benchmarks.bulk_insert [dsn] [rows]
+"""
+
+import asyncio
+import sys
+import time
+from datetime import datetime as dt
+from json import dumps
+
+import asyncpg
+
+ROWS = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+ROUNDS = 5
+
+COLUMNS = ("guild", "channel", "author", "used", "prefix", "command", "failed")
+
+SETUP = """
+    CREATE TEMP TABLE bench_commands (
+        id SERIAL PRIMARY KEY,
+
+        guild BIGINT,
+        channel BIGINT,
+        author BIGINT,
+        used TIMESTAMP,
+        prefix TEXT,
+        command TEXT,
+
+        failed BOOLEAN
+    )
+    """
+
+JSONB_INSERT = """
+    INSERT INTO
+        bench_commands (guild, channel, author, used, prefix, command, failed)
+    SELECT x.guild, x.channel, x.author, x.used, x.prefix, x.command, x.failed
+        FROM JSONB_TO_RECORDSET($1::JSONB) AS
+        x(
+                guild BIGINT,
+                channel BIGINT,
+                author BIGINT,
+                used TIMESTAMP,
+                prefix TEXT,
+                command TEXT,
+                failed BOOLEAN
+        )
+    """
+
+
+def make_rows(count):
+    now = dt.utcnow()
+    return [
+        (
+            809587169520910346 + i % 50,
+            853236064991182909 + i % 200,
+            854027957878390784 + i,
+            now,
+            "$",
+            "about",
+            False,
+        )
+        for i in range(count)
+    ]
+
+
+async def jsonb(conn, rows):
+    payload = [dict(zip(COLUMNS, (*row[:3], row[3].isoformat(), *row[4:]))) for row in rows]
+    await conn.execute(JSONB_INSERT, dumps(payload))
+
+
+async def copy(conn, rows):
+    await conn.copy_records_to_table("bench_commands", columns=COLUMNS, records=rows)
+
+
+async def run(dsn):
+    conn = await asyncpg.connect(dsn)
+    await conn.execute(SETUP)
+    rows = make_rows(ROWS)
+
+    for name, method in (("JSONB_TO_RECORDSET", jsonb), ("COPY", copy)):
+        best = float("inf")
+        for _ in range(ROUNDS):
+            await conn.execute("TRUNCATE bench_commands")
+            start = time.perf_counter()
+            await method(conn, rows)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:<20}{ROWS / best:>14,.0f} rows/sec  ({best * 1000:.2f} ms for {ROWS:,} rows)")
+
+    await conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        from config import postgres_uri as uri
+
+    asyncio.get_event_loop().run_until_complete(run(uri))
@@ -0,0 +1,117 @@
+"""Finalises a burst of giveaways against a local mock of Discord's per-channel rate limits.
+
+Compares firing every finalisation at once with the channel-keyed KeyedQueue used by the
+Giveaways cog. Each finalisation is an edit and a reply, like the real one.
+
+Usage (from src/): python -m scripts.benchmarks.giveaways [giveaways] [channels]
+"""
+
+import asyncio
+import sys
+import time
+
+import aiohttp
+import aiohttp.web
+
+from utils.queues import KeyedQueue
+
+GIVEAWAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CHANNELS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+WORKERS = 4
+
+# each channel allows RATE requests per PER seconds, scaled down from Discord's 5 per 5s
+RATE = 5
+PER = 0.5
+LATENCY = 0.02
+
+PORT = 6789
+
+
+class MockDiscord:
+    def __init__(self):
+        self.buckets = {}
+        self.rate_limited = 0
+
+    async def handle(self, request):
+        await asyncio.sleep(LATENCY)
+        channel = request.match_info["channel"]
+        now = time.perf_counter()
+        window, used = self.buckets.get(channel, (now, 0))
+        if now - window >= PER:
+            window, used = now, 0
+        if used >= RATE:
+            self.rate_limited += 1
+            return aiohttp.web.json_response({"retry_after": PER - (now - window)}, status=429)
+        self.buckets[channel] = (window, used + 1)
+        return aiohttp.web.json_response({})
+
+
+async def call(session, method, path):
+    while True:
+        async with session.request(method, f"http://localhost:{PORT}{path}") as resp:
+            if resp.status != 429:
+                return
+            await asyncio.sleep((await resp.json())["retry_after"])
+
+
+async def finalise(session, giveaway):
+    channel, message = giveaway
+    await call(session, "PATCH", f"/channels/{channel}/messages/{message}")
+    await call(session, "POST", f"/channels/{channel}/messages")
+
+
+def percentiles(latencies):
+    data = sorted(latencies)
+    return ", ".join(
+        f"p{p}: {data[min(len(data) - 1, len(data) * p // 100)] * 1000:.0f} ms" for p in (50, 90, 99)
+    )
+
+
+async def unbounded(session, giveaways):
+    latencies = []
+
+    async def timed(giveaway):
+        start = time.perf_counter()
+        await finalise(session, giveaway)
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed(giveaway) for giveaway in giveaways))
+    return latencies
+
+
+async def queued(session, giveaways):
+    queue = KeyedQueue(lambda giveaway: finalise(session, giveaway), workers=WORKERS)
+    for giveaway in giveaways:
+        queue.put(giveaway[0], giveaway)
+    while len(queue):
+        await asyncio.sleep(0.01)
+    queue.close()
+    return list(queue.latencies)
+
+
+async def run():
+    mock = MockDiscord()
+    app = aiohttp.web.Application()
+    app.router.add_route("*", "/channels/{channel}/messages", mock.handle)
+    app.router.add_route("*", "/channels/{channel}/messages/{message}", mock.handle)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    await aiohttp.web.TCPSite(runner, "localhost", PORT).start()
+
+    giveaways = [(i % CHANNELS, i) for i in range(GIVEAWAYS)]
+    async with aiohttp.ClientSession() as session:
+        for name, method in (("all at once", unbounded), (f"KeyedQueue x{WORKERS}", queued)):
+            mock.buckets.clear()
+            mock.rate_limited = 0
+            start = time.perf_counter()
+            latencies = await method(session, giveaways)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:<16}{elapsed:>8.2f} s total, {mock.rate_limited:>5} x 429, latency {percentiles(latencies)}"
+            )
+
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(run())
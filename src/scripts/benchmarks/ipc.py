@@ -0,0 +1,53 @@
+"""Load tests web-to-bot IPC round trips over a single shared connection.
+
+Usage (from src/): python -m scripts.benchmarks.ipc [requests] [concurrency]
+"""
+
+import asyncio
+import sys
+import time
+
+from web import ipc
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+PORT = 6667
+
+
+class Bot:
+    @staticmethod
+    def get_cog(_):
+        return None
+
+
+@ipc.route(name="bench_echo")
+async def echo(_bot, kwargs):
+    await asyncio.sleep(0.001)
+    return kwargs
+
+
+async def run():
+    server = ipc.Server(Bot(), port=PORT)
+    await server.__start__()
+
+    client = ipc.Client(port=PORT)
+    await client.initiate()
+
+    for concurrency in (1, CONCURRENCY):
+        remaining = iter(range(REQUESTS))
+
+        async def worker():
+            for i in remaining:
+                response = await client.request("bench_echo", i=i)
+                assert response == {"i": i}, f"request {i} received {response!r}"
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        print(f"concurrency {concurrency:<5}{REQUESTS / elapsed:>10,.0f} round trips/sec")
+
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(run())
@@ -0,0 +1,60 @@
+"""Compares IPC round trip latency over TCP and over a unix domain socket.
+
+Usage (from src/): python -m scripts.benchmarks.ipc_transport [requests]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from web import ipc
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+PAYLOADS = (("small", 16), ("large", 256 * 1024))
+
+
+class Bot:
+    @staticmethod
+    def get_cog(_):
+        return None
+
+
+@ipc.route(name="bench_payload")
+async def payload(_bot, kwargs):
+    return "x" * kwargs["size"]
+
+
+async def measure(client, size):
+    latencies = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await client.request("bench_payload", size=size)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100]
+
+
+async def run():
+    path = os.path.join(tempfile.mkdtemp(), "ipc.sock")
+    transports = (
+        ("tcp", {"port": 6668}),
+        ("unix", {"path": path}),
+    )
+
+    for name, kwargs in transports:
+        server = ipc.Server(Bot(), **kwargs)
+        await server.__start__()
+        client = ipc.Client(**kwargs)
+        await client.initiate()
+
+        for label, size in PAYLOADS:
+            p50, p99 = await measure(client, size)
+            print(f"{name:<6}{label:<7}p50 {p50 * 1e6:>9.1f} us   p99 {p99 * 1e6:>9.1f} us")
+
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(run())
@@ -0,0 +1,81 @@
+"""Measures the per-call cost of running a hot query as a raw string against a prepared statement.
+
+"unprepared" disables asyncpg's statement cache, which is what the first call of a query on every
+pooled connection pays. "cached" is a raw string once it is in the connection's statement cache,
+and "prepared" runs a statement prepared up front, like the ones in db.STATEMENTS.
+
+Usage (from src/): python -m scripts.benchmarks.prepared [dsn] [calls]
+"""
+
+import asyncio
+import sys
+import time
+
+import asyncpg
+
+CALLS = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+
+SETUP = """
+    CREATE TEMP TABLE bench_interactions (
+        method TEXT, initiator BIGINT, receiver BIGINT, count INT DEFAULT 1,
+        PRIMARY KEY (method, initiator, receiver)
+    );
+    CREATE TEMP TABLE bench_totals (
+        method TEXT, snowflake BIGINT, count INT DEFAULT 1,
+        PRIMARY KEY (method, snowflake)
+    );
+    INSERT INTO bench_interactions SELECT 'bonk', i, i + 1, i FROM GENERATE_SERIES(1, 10000) AS i;
+    INSERT INTO bench_totals SELECT 'bonk', i + 1, i FROM GENERATE_SERIES(1, 10000) AS i;
+    ANALYZE bench_interactions;
+    ANALYZE bench_totals;
+    """
+
+# same shape as interactions.totals
+QUERY = """
+    SELECT
+        bench_interactions.count AS amount, bench_totals.count AS total
+    FROM
+       bench_interactions
+    INNER JOIN
+        bench_totals
+        ON bench_interactions.receiver = bench_totals.snowflake
+    WHERE
+        initiator = $1 AND receiver = $2 AND bench_interactions.method = $3 AND bench_totals.method = $3
+    """
+
+
+async def measure(call):
+    start = time.perf_counter()
+    for i in range(1, CALLS + 1):
+        await call(i % 10000 + 1)
+    return (time.perf_counter() - start) / CALLS
+
+
+async def run(dsn):
+    unprepared = await asyncpg.connect(dsn, statement_cache_size=0)
+    cached = await asyncpg.connect(dsn)
+
+    results = {}
+    for conn in (unprepared, cached):
+        await conn.execute(SETUP)
+
+    results["unprepared"] = await measure(lambda i: unprepared.fetchrow(QUERY, i, i + 1, "bonk"))
+    results["cached"] = await measure(lambda i: cached.fetchrow(QUERY, i, i + 1, "bonk"))
+    statement = await cached.prepare(QUERY)
+    results["prepared"] = await measure(lambda i: statement.fetchrow(i, i + 1, "bonk"))
+
+    for name, seconds in results.items():
+        saved = results["unprepared"] - seconds
+        print(f"{name:<12}{seconds * 1e6:>9.1f} us/call   saves {saved * 1e6:>7.1f} us/call")
+
+    await unprepared.close()
+    await cached.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        from config import postgres_uri as uri
+
+    asyncio.get_event_loop().run_until_complete(run(uri))
@@ -0,0 +1,73 @@
+"""Checks read replica routing against two local Postgres instances.
+
+The "replica" doesn't have to be a real streaming replica, any second server works since the
+script only looks at which server answered. Reads are expected on the replica, except right after
+a write or inside a transaction, and on the primary once the replica is unreachable.
+
+Usage (from src/): python -m scripts.benchmarks.replicas <primary dsn> <replica dsn> [reads]
+"""
+
+import asyncio
+import sys
+from collections import Counter
+
+import db
+
+READS = int(sys.argv[3]) if len(sys.argv) > 3 else 1_000
+WORKLOADS = {name: {"min_size": 1, "max_size": 2} for name in db.WORKLOADS}
+# nothing listens here, it stands in for a replica that went down
+DEAD_REPLICA = "postgres://postgres@127.0.0.1:1/postgres"
+
+PORT = "SELECT current_setting('port')::INT"
+
+
+async def servers(pool, reads=READS):
+    return Counter([await pool.fetchval(PORT) for _ in range(reads)])
+
+
+def report(name, answered, expected):
+    status = "ok" if set(answered) == {expected} else "FAIL"
+    print(f"{name:<28}{dict(answered)}  [{status}]")
+
+
+async def run(primary_dsn, replica_dsn):
+    pool = await db.create_pool(
+        None, primary_dsn, workloads=WORKLOADS, replicas=[replica_dsn], replica_max_lag=1
+    )
+    primary = await pool.workload("background").fetchval(PORT)
+    replica = await pool.workload("replica-1").fetchval(PORT)
+    if primary == replica:
+        raise SystemExit("Both DSNs point at the same server")
+
+    report("plain reads", await servers(pool), replica)
+
+    async def after_write():
+        await pool.execute("SELECT 1")
+        return await servers(pool)
+
+    report("reads right after a write", await asyncio.create_task(after_write()), primary)
+
+    async def in_transaction():
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                return await servers(pool)
+
+    report("reads inside a transaction", await asyncio.create_task(in_transaction()), primary)
+
+    async def later():
+        await pool.execute("SELECT 1")
+        await asyncio.sleep(1.5)
+        return await servers(pool)
+
+    report("reads after the lag window", await asyncio.create_task(later()), replica)
+    await pool.close_all()
+
+    pool = await db.create_pool(None, primary_dsn, workloads=WORKLOADS, replicas=[DEAD_REPLICA])
+    report("reads with a dead replica", await servers(pool), primary)
+    await pool.close_all()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        raise SystemExit(__doc__)
+    asyncio.get_event_loop().run_until_complete(run(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,69 @@
+"""Measures what the socket rate ring buffer adds to on_socket_response, per gateway event.
+
+"counter" is the listener as it was, only bumping the lifetime and flush counters. "rates" adds
+EventRates.add on top of it. Events are replayed with the mix of a busy shard, against the real
+clock, so the once a second rotation is included in the cost the same way it is in the bot.
+
+Usage (from src/): python -m scripts.benchmarks.socket_rates [events]
+"""
+
+import random
+import sys
+import time
+from collections import Counter
+
+from utils.rates import EventRates
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+MIX = {
+    "MESSAGE_CREATE": 40,
+    "TYPING_START": 20,
+    "PRESENCE_UPDATE": 15,
+    "GUILD_MEMBER_UPDATE": 8,
+    "MESSAGE_UPDATE": 6,
+    "MESSAGE_REACTION_ADD": 5,
+    "VOICE_STATE_UPDATE": 3,
+    "INTERACTION_CREATE": 2,
+    "MESSAGE_DELETE": 1,
+}
+
+
+def run(payloads, listener) -> float:
+    start = time.perf_counter()
+    for data in payloads:
+        listener(data)
+    return time.perf_counter() - start
+
+
+def main():
+    random.seed(0)
+    payloads = [{"t": t} for t in random.choices(list(MIX), weights=list(MIX.values()), k=EVENTS)]
+
+    socket_stats, socket_cache = Counter(), Counter()
+
+    def counter(data):
+        if event := data.get("t"):
+            socket_stats[event] += 1
+            socket_cache[event] += 1
+
+    rates = EventRates()
+
+    def with_rates(data):
+        if event := data.get("t"):
+            socket_stats[event] += 1
+            rates.add(event)
+            socket_cache[event] += 1
+
+    results = {}
+    for name, listener in (("counter", counter), ("rates", with_rates)):
+        # best of 3, the first run also warms up
+        results[name] = min(run(payloads, listener) for _ in range(3))
+        print(f"{name:<10}{results[name] / EVENTS * 1e9:>8.0f} ns/event")
+
+    print(f"{'overhead':<10}{(results['rates'] - results['counter']) / EVENTS * 1e9:>8.0f} ns/event")
+    print(rates.total())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Stress test for the swapped stats buffers in BackgroundEvents.
+
+Producers hammer on_command_completion, on_member_update and on_user_update while two flushers
+(the bulk_insert loop and a shutdown style flush) write to a fake connection. Every call on the
+connection is slow and some of them fail, so flushes overlap the listeners, roll back and spill
+to the spool, and the spool is replayed later. The buffers are also kept small, so they overflow
+mid-flush, into an early flush or, while flushes are failing, into the spool.
+
+Fails if a listener ever awaits, or if any row is lost or written twice.
+
+Usage (from src/): python -m scripts.benchmarks.stats_buffers [events] [outage rate per round trip]
+"""
+
+import asyncio
+import logging
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime as dt, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from bot.core.usage import LiveUsage
+from bot.extensions import background
+from utils.spool import Spool
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+FAILURE_RATE = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+PRODUCERS = 8
+OUTAGE = 0.05
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.failure_rate = FAILURE_RATE
+        # failures come as short outages, after which both flushers try to replay the spool at once
+        self.down_until = 0.0
+        self.committed = {"commands": Counter(), "nicknames": Counter(), "usernames": Counter()}
+
+
+class FakeConnection:
+    """Commits what a transaction wrote only if it finished, like Postgres would."""
+
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+        self._staged = None
+
+    async def _round_trip(self):
+        await asyncio.sleep(random.uniform(0, 0.02))
+        if time.monotonic() < self.database.down_until:
+            raise OSError("connection refused")
+        if random.random() < self.database.failure_rate:
+            self.database.down_until = time.monotonic() + OUTAGE
+            raise OSError("connection reset")
+
+    @asynccontextmanager
+    async def transaction(self):
+        self._staged = {table: Counter() for table in self.database.committed}
+        try:
+            yield
+        finally:
+            staged, self._staged = self._staged, None
+        for table, rows in staged.items():
+            self.database.committed[table].update(rows)
+
+    async def copy_records_to_table(self, table, *, schema_name, columns, records):
+        await self._round_trip()
+        self._staged[table].update(records)
+
+    async def prepared(self, name):
+        return SimpleNamespace(fetch=self._fetch)
+
+    async def _fetch(self, *args):
+        await self._round_trip()
+        return []
+
+
+class FakePool:
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+
+    def workload(self, name):
+        return self
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        await asyncio.sleep(random.uniform(0, 0.005))
+        yield FakeConnection(self.database)
+
+
+def run_listener(coro):
+    """Runs a listener coroutine, failing if it would have to wait for anything."""
+    try:
+        coro.send(None)
+    except StopIteration:
+        return
+    coro.close()
+    raise AssertionError("A listener awaited, so it could block on the database")
+
+
+def command(i: int):
+    return SimpleNamespace(
+        command=SimpleNamespace(qualified_name=f"command{i % 20}"),
+        command_failed=i % 7 == 0,
+        guild=SimpleNamespace(id=i % 50),
+        # the channel carries the event number, so every row is unique
+        channel=SimpleNamespace(id=i),
+        author=SimpleNamespace(id=i % 1000),
+        message=SimpleNamespace(created_at=dt.now(timezone.utc)),
+        clean_prefix="!",
+    )
+
+
+def member(i: int, nick: str):
+    return SimpleNamespace(display_name=nick, nick=nick, id=i, guild=SimpleNamespace(id=i % 50))
+
+
+def user(i: int, name: str):
+    return SimpleNamespace(name=name, id=i)
+
+
+async def produce(cog, events: range, expected: dict, listener_times: list):
+    for i in events:
+        kind = i % 3
+        start = time.perf_counter()
+        if kind == 0:
+            ctx = command(i)
+            run_listener(cog.on_command_completion(ctx))
+            expected["commands"][
+                (
+                    ctx.guild.id,
+                    ctx.channel.id,
+                    ctx.author.id,
+                    ctx.message.created_at.replace(tzinfo=None),
+                    "!",
+                    ctx.command.qualified_name,
+                    ctx.command_failed,
+                )
+            ] += 1
+        elif kind == 1:
+            run_listener(cog.on_member_update(member(i, "old"), member(i, f"nick-{i}")))
+            expected["nicknames"][(i % 50, i, f"nick-{i}")] += 1
+        else:
+            run_listener(cog.on_user_update(user(i, "old"), user(i, f"name-{i}")))
+            expected["usernames"][(i, f"name-{i}")] += 1
+        listener_times.append(time.perf_counter() - start)
+
+        if i % 50 == 0:
+            # let the flushers in, the gateway hands over control between events too
+            await asyncio.sleep(0)
+
+
+async def flusher(cog, done: asyncio.Event, interval: float):
+    while not done.is_set():
+        await cog.flush()
+        await asyncio.sleep(interval)
+
+
+async def settle():
+    """Waits for the early flushes and spills the listeners handed off."""
+    while pending := asyncio.all_tasks() - {asyncio.current_task()}:
+        await asyncio.gather(*pending)
+
+
+async def main():
+    # every failed flush logs a warning
+    logging.getLogger(background.__name__).setLevel(logging.ERROR)
+    # small buffers, so they overflow to the spool while a flush is in flight
+    background.MAX_BUFFERED = 200
+
+    database = FakeDatabase()
+    bot = SimpleNamespace(
+        pool=FakePool(database),
+        extra=SimpleNamespace(command_stats=Counter()),
+        usage=LiveUsage(),
+        # never set, so the cog's own loops wait and the flushers below are the only ones
+        prepped=asyncio.Event(),
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        cog = background.BackgroundEvents(bot)
+        cog.bulk_insert.cancel()
+        cog.maintain_partitions.cancel()
+        cog.spool = Spool(str(Path(directory) / "stats.spool"))
+
+        expected = {table: Counter() for table in database.committed}
+        listener_times = []
+        done = asyncio.Event()
+
+        start = time.perf_counter()
+        flushers = [
+            asyncio.create_task(flusher(cog, done, 0.01)),
+            # close() flushing while the loop is in the middle of its own flush
+            asyncio.create_task(flusher(cog, done, 0.037)),
+        ]
+        await asyncio.gather(
+            *(
+                produce(cog, range(worker, EVENTS, PRODUCERS), expected, listener_times)
+                for worker in range(PRODUCERS)
+            )
+        )
+        done.set()
+        await asyncio.gather(*flushers)
+        await settle()
+
+        # one last outage, so there is a spool to replay when shutting down
+        database.failure_rate, database.down_until = 0, float("inf")
+        await produce(cog, range(EVENTS, EVENTS + 1000), expected, listener_times)
+        await settle()
+        await cog.flush()
+        assert cog.spool, "nothing was spooled during the outage"
+
+        # the database is back, and close() flushes while the bulk_insert loop is in its own flush
+        database.down_until = 0.0
+        await asyncio.gather(cog.flush(), cog.flush())
+        elapsed = time.perf_counter() - start
+        assert not cog.spool, "rows were left in the spool"
+
+    for table, rows in expected.items():
+        written = database.committed[table]
+        lost = rows - written
+        duplicated = written - rows
+        print(f"{table:<10}{sum(rows.values()):>8} sent {sum(written.values()):>8} written")
+        assert not lost, f"{sum(lost.values())} {table} rows were lost"
+        assert not duplicated, f"{sum(duplicated.values())} {table} rows were written twice"
+
+    listener_times.sort()
+    p99 = listener_times[len(listener_times) * 99 // 100]
+    print(
+        f"{len(listener_times):,} events in {elapsed:.2f}s, listener p99 {p99 * 1e6:.1f} us, max {listener_times[-1] * 1e6:.1f} us"
+    )
+    print("No rows lost or duplicated.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
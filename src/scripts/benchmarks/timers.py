@@ -0,0 +1,130 @@
+"""Compares dispatch throughput of the old one-timer-per-round-trip loop against batched claiming.
+
+Batches are claimed and released with the timers.claim and timers.release statements the bot
+runs. The last run leases timers from several connections at once with SKIP LOCKED, and fails if
+any timer was dispatched more than once or not at all.
+
+The timers go in a uniquely named table, dropped again at the end, as the dispatchers each need
+their own connection and so can't share a TEMP table.
+
+Usage (from src/): python -m scripts.benchmarks.timers [dsn] [timers] [dispatchers]
+"""
+
+import asyncio
+import sys
+import time
+from collections import Counter
+from datetime import datetime as dt, timedelta, timezone
+from uuid import uuid4
+
+import asyncpg
+
+from db.statements import STATEMENTS
+
+TIMERS = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+DISPATCHERS = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+CLAIM_BATCH = 500
+LEASE = timedelta(seconds=60)
+
+TABLE = f"bench_timers_{uuid4().hex[:12]}"
+
+SETUP = f"""
+    CREATE TABLE {TABLE} (
+        id SERIAL PRIMARY KEY,
+
+        event TEXT NOT NULL,
+        created TIMESTAMPTZ NOT NULL,
+        expires TIMESTAMPTZ NOT NULL,
+        data JSONB NOT NULL,
+
+        leased_until TIMESTAMPTZ,
+        leased_by TEXT
+    );
+    CREATE INDEX ON {TABLE} (expires);
+    """
+
+FILL = f"""
+    INSERT INTO
+        {TABLE} (event, created, expires, data)
+    SELECT
+        'reminder', NOW(), NOW() - (i * INTERVAL '1 millisecond'), '{{}}'::JSONB
+    FROM
+        GENERATE_SERIES(1, $1) AS i
+    """
+
+CLAIM = STATEMENTS["timers.claim"].replace("events.timers", TABLE)
+RELEASE = STATEMENTS["timers.release"].replace("events.timers", TABLE)
+
+
+async def one_by_one(conn):
+    dispatched = []
+    while True:
+        timer = await conn.fetchrow(
+            f"SELECT * FROM {TABLE} WHERE expires < NOW() + INTERVAL '10 days' ORDER BY expires LIMIT 1"
+        )
+        if timer is None:
+            return dispatched
+        await conn.execute(f"DELETE FROM {TABLE} WHERE id = $1", timer["id"])
+        dispatched.append(timer["id"])
+
+
+async def claimed(conn):
+    """Dispatches like Reminders.dispatch_due, a batch is leased, fired and then released."""
+    dispatcher_id = uuid4().hex
+    claim, release = await conn.prepare(CLAIM), await conn.prepare(RELEASE)
+    dispatched = []
+    while timers := await claim.fetch(dt.now(timezone.utc), CLAIM_BATCH, LEASE, dispatcher_id):
+        ids = [timer["id"] for timer in timers]
+        dispatched.extend(ids)
+        await release.fetch(ids, dispatcher_id)
+    return dispatched
+
+
+async def run(dsn):
+    conn = await asyncpg.connect(dsn)
+    await conn.execute(SETUP)
+    try:
+        for name, method in (("LIMIT 1 + DELETE", one_by_one), ("claim + release", claimed)):
+            await conn.execute(f"TRUNCATE {TABLE}")
+            await conn.execute(FILL, TIMERS)
+
+            start = time.perf_counter()
+            dispatched = len(await method(conn))
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:<22}{dispatched / elapsed:>12,.0f} timers/sec  ({elapsed:.2f} s for {dispatched:,} timers)"
+            )
+
+        await conn.execute(f"TRUNCATE {TABLE}")
+        await conn.execute(FILL, TIMERS)
+        dispatchers = [await asyncpg.connect(dsn) for _ in range(DISPATCHERS)]
+        try:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(claimed(dispatcher) for dispatcher in dispatchers))
+            elapsed = time.perf_counter() - start
+        finally:
+            await asyncio.gather(*(dispatcher.close() for dispatcher in dispatchers))
+
+        counts = Counter(timer_id for ids in results for timer_id in ids)
+        name = f"{DISPATCHERS} dispatchers"
+        print(
+            f"{name:<22}{len(counts) / elapsed:>12,.0f} timers/sec  ({elapsed:.2f} s for {len(counts):,} timers)"
+        )
+        print(f"{'per dispatcher':<22}{', '.join(f'{len(ids):,}' for ids in results)}")
+
+        duplicated = [timer_id for timer_id, count in counts.items() if count > 1]
+        assert not duplicated, f"{len(duplicated)} timers were dispatched more than once"
+        assert len(counts) == TIMERS, f"{TIMERS - len(counts)} timers were never dispatched"
+        print("Every timer was dispatched exactly once.")
+    finally:
+        await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        from config import postgres_uri as uri
+
+    asyncio.get_event_loop().run_until_complete(run(uri))
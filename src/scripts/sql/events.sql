@@ -6,5 +6,44 @@ CREATE TABLE IF NOT EXISTS events.timers (
     event TEXT NOT NULL,
     created TIMESTAMPTZ NOT NULL,
     expires TIMESTAMPTZ NOT NULL,
-    data JSONB NOT NULL
-)
\ No newline at end of file
+    data JSONB NOT NULL,
+
+    leased_until TIMESTAMPTZ,
+    leased_by TEXT
+);
+
+ALTER TABLE events.timers ADD COLUMN IF NOT EXISTS leased_until TIMESTAMPTZ;
+ALTER TABLE events.timers ADD COLUMN IF NOT EXISTS leased_by TEXT;
+
+CREATE TABLE IF NOT EXISTS events.giveaways (
+    message BIGINT PRIMARY KEY,
+
+    channel BIGINT NOT NULL,
+    guild BIGINT NOT NULL,
+    emoji BIGINT NOT NULL,
+    prize TEXT NOT NULL,
+    winners INTEGER NOT NULL,
+    expires TIMESTAMPTZ NOT NULL,
+
+    ended BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS events.giveaway_entrants (
+    message BIGINT,
+    member BIGINT,
+    PRIMARY KEY (message, member)
+);
+
+CREATE OR REPLACE FUNCTION events.notify_timer() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'timers',
+        json_build_object('id', NEW.id, 'expires', EXTRACT(EPOCH FROM NEW.expires))::TEXT
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS timer_insert ON events.timers;
+CREATE TRIGGER timer_insert AFTER INSERT ON events.timers
+    FOR EACH ROW EXECUTE PROCEDURE events.notify_timer();
\ No newline at end of file
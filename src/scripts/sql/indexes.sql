@@ -3,6 +3,10 @@ CREATE INDEX IF NOT EXISTS id_guild ON public.guilds (id);
 CREATE INDEX IF NOT EXISTS game_user_games ON users.games (game, snowflake);
 
 CREATE INDEX IF NOT EXISTS timer_expires ON events.timers (expires);
+CREATE INDEX IF NOT EXISTS giveaway_channel ON events.giveaways (channel, expires);
+CREATE INDEX IF NOT EXISTS giveaway_guild ON events.giveaways (guild, expires);
 
 CREATE INDEX IF NOT EXISTS guild_command ON stats.commands (guild);
-CREATE INDEX IF NOT EXISTS user_command ON stats.commands (author);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS user_command ON stats.commands (author);
+CREATE INDEX IF NOT EXISTS guild_command_daily ON stats.commands_daily (guild, day);
+CREATE INDEX IF NOT EXISTS user_totals_uses ON stats.user_totals (guild, uses DESC);
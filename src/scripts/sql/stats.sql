@@ -5,9 +5,19 @@ CREATE TABLE IF NOT EXISTS stats.socket (
     count BIGINT
 );
 
-CREATE TABLE IF NOT EXISTS stats.commands (
-    id SERIAL PRIMARY KEY,
+-- moves an unpartitioned stats.commands out of the way, its rows are copied over further down
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'stats' AND c.relname = 'commands' AND c.relkind = 'r'
+    ) THEN
+        ALTER TABLE stats.commands RENAME TO commands_legacy;
+        DROP INDEX IF EXISTS stats.guild_command, stats.user_command;
+    END IF;
+END $$;
 
+CREATE TABLE IF NOT EXISTS stats.commands (
     guild BIGINT,
     channel BIGINT,
     author BIGINT,
@@ -16,4 +26,229 @@ CREATE TABLE IF NOT EXISTS stats.commands (
     command TEXT,
 
     failed BOOLEAN
-);
\ No newline at end of file
+) PARTITION BY RANGE (used);
+
+-- catches rows for months without a partition, they are moved out when the partition is created
+CREATE TABLE IF NOT EXISTS stats.commands_default PARTITION OF stats.commands DEFAULT;
+
+-- counts per command, guild (0 for DMs) and failure, kept up to date as command rows are written
+CREATE TABLE IF NOT EXISTS stats.commands_hourly (
+    hour TIMESTAMP,
+    command TEXT,
+    guild BIGINT,
+    failed BOOLEAN,
+    count BIGINT NOT NULL,
+
+    PRIMARY KEY (hour, command, guild, failed)
+);
+
+-- commands per author, guild (0 for DMs) and hour, so the usage of the last week can be loaded without a scan
+CREATE TABLE IF NOT EXISTS stats.users_hourly (
+    hour TIMESTAMP,
+    guild BIGINT,
+    author BIGINT,
+    count BIGINT NOT NULL,
+
+    PRIMARY KEY (hour, guild, author)
+);
+
+CREATE TABLE IF NOT EXISTS stats.commands_daily (
+    day DATE,
+    command TEXT,
+    guild BIGINT,
+    failed BOOLEAN,
+    count BIGINT NOT NULL,
+
+    PRIMARY KEY (day, command, guild, failed)
+);
+
+-- all time usage per guild, guild 0 holds every guild and DMs combined
+CREATE TABLE IF NOT EXISTS stats.command_totals (
+    guild BIGINT,
+    command TEXT,
+    uses BIGINT NOT NULL,
+    failures BIGINT NOT NULL,
+
+    PRIMARY KEY (guild, command)
+);
+
+CREATE TABLE IF NOT EXISTS stats.user_totals (
+    guild BIGINT,
+    author BIGINT,
+    uses BIGINT NOT NULL,
+
+    PRIMARY KEY (guild, author)
+);
+
+-- running totals, e.g. every command ever used, so they can be read without a scan
+CREATE TABLE IF NOT EXISTS stats.totals (
+    name TEXT PRIMARY KEY,
+    count BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION stats.create_command_partition(month DATE) RETURNS VOID AS $$
+DECLARE
+    start DATE := DATE_TRUNC('month', month)::DATE;
+    finish DATE := (start + INTERVAL '1 month')::DATE;
+    partition_name TEXT := 'commands_' || TO_CHAR(start, 'YYYY_MM');
+BEGIN
+    IF TO_REGCLASS('stats.' || partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    -- a new partition can't be attached while the default partition holds rows in its range
+    CREATE TEMP TABLE moved_commands (LIKE stats.commands);
+    WITH moved AS (
+        DELETE FROM stats.commands_default WHERE used >= start AND used < finish RETURNING *
+    )
+    INSERT INTO moved_commands SELECT * FROM moved;
+
+    EXECUTE FORMAT(
+        'CREATE TABLE stats.%I PARTITION OF stats.commands FOR VALUES FROM (%L) TO (%L)',
+        partition_name, start, finish
+    );
+
+    INSERT INTO stats.commands SELECT * FROM moved_commands;
+    DROP TABLE moved_commands;
+END;
+$$ LANGUAGE plpgsql;
+
+-- drops every monthly partition that ends on or before the given date, returning their names
+CREATE OR REPLACE FUNCTION stats.drop_command_partitions(before DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT
+            c.relname
+        FROM
+            pg_inherits i
+        JOIN
+            pg_class c ON c.oid = i.inhrelid
+        WHERE
+            i.inhparent = 'stats.commands'::REGCLASS
+            AND c.relname ~ '^commands_\d{4}_\d{2}$'
+            AND TO_DATE(SUBSTR(c.relname, 10), 'YYYY_MM') + INTERVAL '1 month' <= before
+    LOOP
+        EXECUTE FORMAT('DROP TABLE stats.%I', partition_name);
+        RETURN NEXT partition_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT stats.create_command_partition(NOW()::DATE);
+SELECT stats.create_command_partition((NOW() + INTERVAL '1 month')::DATE);
+
+-- copies the rows of an unpartitioned stats.commands over and builds the rollups from them
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    IF TO_REGCLASS('stats.commands_legacy') IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR month IN
+        SELECT DISTINCT DATE_TRUNC('month', used)::DATE FROM stats.commands_legacy WHERE used IS NOT NULL
+    LOOP
+        PERFORM stats.create_command_partition(month);
+    END LOOP;
+
+    INSERT INTO
+        stats.commands (guild, channel, author, used, prefix, command, failed)
+    SELECT
+        guild, channel, author, used, prefix, command, failed
+    FROM
+        stats.commands_legacy;
+
+    INSERT INTO
+        stats.commands_hourly (hour, command, guild, failed, count)
+    SELECT
+        DATE_TRUNC('hour', used), command, COALESCE(guild, 0), COALESCE(failed, FALSE), COUNT(*)
+    FROM
+        stats.commands_legacy
+    WHERE
+        used IS NOT NULL
+    GROUP BY
+        1, 2, 3, 4
+    ON CONFLICT (hour, command, guild, failed)
+        DO UPDATE SET count = commands_hourly.count + EXCLUDED.count;
+
+    INSERT INTO
+        stats.commands_daily (day, command, guild, failed, count)
+    SELECT
+        used::DATE, command, COALESCE(guild, 0), COALESCE(failed, FALSE), COUNT(*)
+    FROM
+        stats.commands_legacy
+    WHERE
+        used IS NOT NULL
+    GROUP BY
+        1, 2, 3, 4
+    ON CONFLICT (day, command, guild, failed)
+        DO UPDATE SET count = commands_daily.count + EXCLUDED.count;
+
+    INSERT INTO
+        stats.totals (name, count)
+    SELECT
+        'commands', COUNT(*)
+    FROM
+        stats.commands_legacy
+    UNION ALL
+    SELECT
+        'commands_failed', COUNT(*) FILTER (WHERE failed)
+    FROM
+        stats.commands_legacy
+    ON CONFLICT (name)
+        DO UPDATE SET count = totals.count + EXCLUDED.count;
+
+    DROP TABLE stats.commands_legacy;
+END $$;
+
+-- fills the all time usage tables from whatever raw rows are left, the first time they are created
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM stats.command_totals) OR EXISTS (SELECT 1 FROM stats.user_totals) THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO
+        stats.command_totals (guild, command, uses, failures)
+    SELECT
+        COALESCE(guild, 0), command, COUNT(*), COUNT(*) FILTER (WHERE failed)
+    FROM
+        stats.commands
+    GROUP BY
+        GROUPING SETS ((guild, command), (command))
+    HAVING
+        GROUPING(guild) = 1 OR guild IS NOT NULL;
+
+    INSERT INTO
+        stats.user_totals (guild, author, uses)
+    SELECT
+        COALESCE(guild, 0), author, COUNT(*)
+    FROM
+        stats.commands
+    GROUP BY
+        GROUPING SETS ((guild, author), (author))
+    HAVING
+        GROUPING(guild) = 1 OR guild IS NOT NULL;
+END $$;
+
+-- fills the hourly usage per author from the raw rows, the first time it is created
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM stats.users_hourly) THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO
+        stats.users_hourly (hour, guild, author, count)
+    SELECT
+        DATE_TRUNC('hour', used), COALESCE(guild, 0), author, COUNT(*)
+    FROM
+        stats.commands
+    WHERE
+        used >= NOW() - INTERVAL '35 days'
+    GROUP BY
+        1, 2, 3;
+END $$;
@@ -0,0 +1,92 @@
+from math import frexp
+from typing import Dict, Iterable, List
+
+__all__ = ("Histogram",)
+
+
+class Histogram:
+    """Fixed-memory log-linear histogram of durations, in seconds.
+
+    Every power of two between ``lowest`` and ``highest`` is split into ``precision`` equal buckets,
+    so any recorded value is off by at most 1 / precision of itself (about 6% with the defaults)
+    while memory stays the same however many values are recorded.
+    """
+
+    __slots__ = ("lowest", "precision", "counts", "count", "total", "max")
+
+    def __init__(self, *, lowest: float = 1e-6, highest: float = 600.0, precision: int = 16):
+        self.lowest = lowest
+        self.precision = precision
+
+        _, exponent = frexp(highest / lowest)
+        self.counts: List[int] = [0] * (exponent * precision + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        scaled = value / self.lowest
+        if scaled < 1:
+            return 0
+        # scaled = mantissa * 2 ** exponent with 0.5 <= mantissa < 1
+        mantissa, exponent = frexp(scaled)
+        index = (exponent - 1) * self.precision + int((mantissa * 2 - 1) * self.precision) + 1
+        return min(index, len(self.counts) - 1)
+
+    def _value(self, index: int) -> float:
+        """Midpoint of a bucket."""
+        if index == 0:
+            return self.lowest / 2
+        exponent, step = divmod(index - 1, self.precision)
+        return self.lowest * 2**exponent * (1 + (step + 0.5) / self.precision)
+
+    def record(self, value: float):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram"):
+        layout = (self.lowest, self.precision, len(self.counts))
+        if (other.lowest, other.precision, len(other.counts)) != layout:
+            raise ValueError("Can only merge histograms with the same layout")
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def clear(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percentile: float) -> float:
+        if not self.count:
+            return 0.0
+        # rank of the value we are after, 1 based
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def percentiles(self, percentiles: Iterable[float] = (50, 95, 99)) -> Dict[float, float]:
+        return {p: self.percentile(p) for p in percentiles}
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 99)) -> Dict[str, float]:
+        """Count, mean, percentiles and max, with durations in milliseconds."""
+        return {
+            "count": self.count,
+            "mean": round(self.mean * 1000, 2),
+            **{f"p{p:g}": round(value * 1000, 2) for p, value in self.percentiles(percentiles).items()},
+            "max": round(self.max * 1000, 2),
+        }
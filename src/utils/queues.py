@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Iterable, Optional, Tuple
+
+__all__ = ("KeyedQueue",)
+
+log = logging.getLogger(__name__)
+
+
+class KeyedQueue:
+    """Runs jobs on a bounded pool of workers, never more than one job at a time per key.
+
+    Keying jobs by channel keeps every worker inside a different rate limit bucket, instead of
+    all of them piling into the same one and retrying.
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], *, workers: int = 4, loop=None):
+        self.handler = handler
+        self.loop = loop or asyncio.get_event_loop()
+
+        self._pending: Dict[Hashable, Deque[Tuple[float, Any]]] = {}
+        self._ready = asyncio.Queue()
+        self._workers = [self.loop.create_task(self._worker()) for _ in range(workers)]
+
+        # seconds between a job being queued and finishing
+        self.latencies = deque(maxlen=1000)
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def put(self, key: Hashable, job: Any):
+        entry = (time.perf_counter(), job)
+        if key in self._pending:
+            # a worker is already on this key (or about to be), it drains the new job as well
+            self._pending[key].append(entry)
+        else:
+            self._pending[key] = deque((entry,))
+            self._ready.put_nowait(key)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            jobs = self._pending[key]
+            while jobs:
+                queued, job = jobs[0]
+                try:
+                    await self.handler(job)
+                except Exception:
+                    log.exception(f"Job for {key!r} raised an exception")
+                jobs.popleft()
+                self.latencies.append(time.perf_counter() - queued)
+            del self._pending[key]
+            self._ready.task_done()
+
+    def percentiles(self, percentiles: Iterable[int] = (50, 90, 99)) -> Dict[int, float]:
+        data = sorted(self.latencies)
+        if not data:
+            return {}
+        return {p: data[min(len(data) - 1, len(data) * p // 100)] for p in percentiles}
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Waits for every queued job to finish, then stops the workers."""
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Stopped with {len(self)} jobs left after waiting {timeout} seconds")
+        finally:
+            self.close()
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
@@ -0,0 +1,100 @@
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+__all__ = ("EventRates",)
+
+
+class EventRates:
+    """Per-second event counts over a sliding window, for current, windowed and peak rates.
+
+    Recording an event is a clock read and a dict increment. Everything else happens once a second,
+    when the finished second is pushed into a ring buffer and added to a running sum per window, and
+    the second falling out of each window is subtracted again.
+    """
+
+    def __init__(self, windows: Tuple[int, ...] = (60, 300, 900), *, clock=time.monotonic):
+        self.windows = windows
+        self.size = max(windows)
+        self.clock = clock
+
+        # slot -> (second, counts) of the last `size` finished seconds
+        self._ring: List[Optional[Tuple[int, Counter]]] = [None] * self.size
+        self._sums: Dict[int, Counter] = {window: Counter() for window in windows}
+        self._second = int(clock())
+        self._counts = Counter()
+        self._last = Counter()
+        self._started = self._second
+
+        # highest count seen in a single second, per event and for every event combined
+        self.peaks = Counter()
+        self.peak_total = 0
+
+    def add(self, event: str):
+        second = int(self.clock())
+        if second != self._second:
+            self._advance(second)
+        self._counts[event] += 1
+
+    def _advance(self, second: int):
+        finished, counts = self._second, self._counts
+        self._second, self._counts = second, Counter()
+
+        if second - finished > self.size:
+            # idle for longer than the largest window, nothing in the ring counts anymore
+            self._ring = [None] * self.size
+            self._sums = {window: Counter() for window in self.windows}
+        else:
+            self._push(finished, counts)
+            # seconds without any events still push older seconds out of the windows
+            for empty in range(finished + 1, second):
+                self._push(empty, Counter())
+
+        self._last = counts if second - finished == 1 else Counter()
+        for event, count in counts.items():
+            if count > self.peaks[event]:
+                self.peaks[event] = count
+        self.peak_total = max(self.peak_total, sum(counts.values()))
+
+    def _push(self, second: int, counts: Counter):
+        for window, sums in self._sums.items():
+            expired = self._ring[(second - window) % self.size]
+            if expired is not None and expired[0] == second - window:
+                sums -= expired[1]
+            sums.update(counts)
+        self._ring[second % self.size] = (second, counts) if counts else None
+
+    def rates(self) -> Dict[str, Dict[str, float]]:
+        """Events per second per event type: the last full second, every window and the peak."""
+        second = int(self.clock())
+        if second != self._second:
+            self._advance(second)
+
+        # don't average over time from before the counting started
+        spans = {window: max(1, min(window, second - self._started)) for window in self.windows}
+        return {
+            event: {
+                "current": self._last[event],
+                **{
+                    f"{window // 60}m": round(self._sums[window][event] / spans[window], 2)
+                    for window in self.windows
+                },
+                "peak": self.peaks[event],
+            }
+            for event in self.peaks
+        }
+
+    def total(self) -> Dict[str, float]:
+        second = int(self.clock())
+        if second != self._second:
+            self._advance(second)
+
+        spans = {window: max(1, min(window, second - self._started)) for window in self.windows}
+        return {
+            "current": sum(self._last.values()),
+            **{
+                f"{window // 60}m": round(sum(self._sums[window].values()) / spans[window], 2)
+                for window in self.windows
+            },
+            "peak": self.peak_total,
+        }
@@ -0,0 +1,94 @@
+from hashlib import blake2b
+from math import log
+from typing import Dict, Hashable, List, Tuple
+
+__all__ = ("SpaceSaving", "HyperLogLog")
+
+
+class SpaceSaving:
+    """Top-k heavy hitters of a stream in fixed memory (Metwally et al.).
+
+    At most ``capacity`` items are tracked. A new item replaces the one with the lowest count and
+    inherits that count as its error, so a reported count is never lower than the true count and at
+    most ``error`` higher. Any item seen more than total / capacity times is guaranteed to be tracked.
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "total")
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.counts: Dict[Hashable, float] = {}
+        self.errors: Dict[Hashable, float] = {}
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item: Hashable, count: float = 1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            evicted = min(self.counts, key=self.counts.__getitem__)
+            floor = self.counts.pop(evicted)
+            del self.errors[evicted]
+            self.counts[item] = floor + count
+            self.errors[item] = floor
+
+    def decay(self, factor: float):
+        """Scales every count down, so old traffic fades and the top reflects what is happening now."""
+        self.total *= factor
+        for item in self.counts:
+            self.counts[item] *= factor
+            self.errors[item] *= factor
+
+    def top(self, n: int = 10) -> List[Tuple[Hashable, float, float]]:
+        """The n items with the highest counts, as (item, count, error)."""
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+
+class HyperLogLog:
+    """Estimates the number of distinct items seen in 2 ** precision bytes.
+
+    The standard error is about 1.04 / sqrt(2 ** precision), 1.6% at the default precision.
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item: Hashable):
+        value = int.from_bytes(blake2b(repr(item).encode(), digest_size=8).digest(), "big")
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        # position of the first set bit in the remaining bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Can only merge sketches with the same precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        return round(self.count())
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0**-register for register in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate while many registers are still empty
+            return m * log(m / zeros)
+        return estimate
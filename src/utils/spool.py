@@ -0,0 +1,207 @@
+import logging
+import os
+import struct
+from datetime import datetime as dt, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+__all__ = ("Spool", "CorruptSpool")
+
+log = logging.getLogger(__name__)
+
+# every frame is <payload length><kind> followed by the encoded rows
+FRAME = struct.Struct("<IB")
+ROW = struct.Struct("<B")
+LENGTH = struct.Struct("<I")
+INT = struct.Struct("<q")
+
+NONE, INTEGER, STRING, TRUE, FALSE, DATETIME = range(6)
+
+EPOCH = dt(1970, 1, 1)
+
+DECODE_ERRORS = (struct.error, IndexError, UnicodeDecodeError, OverflowError)
+
+
+class CorruptSpool(ValueError):
+    """A frame in the spool could not be decoded."""
+
+
+def encode_row(row: tuple) -> bytes:
+    parts = [ROW.pack(len(row))]
+    for value in row:
+        if value is None:
+            parts.append(bytes((NONE,)))
+        elif value is True:
+            parts.append(bytes((TRUE,)))
+        elif value is False:
+            parts.append(bytes((FALSE,)))
+        elif isinstance(value, int):
+            parts.append(bytes((INTEGER,)) + INT.pack(value))
+        elif isinstance(value, str):
+            encoded = value.encode("utf-8")
+            parts.append(bytes((STRING,)) + LENGTH.pack(len(encoded)) + encoded)
+        elif isinstance(value, dt):
+            parts.append(bytes((DATETIME,)) + INT.pack((value - EPOCH) // timedelta(microseconds=1)))
+        else:
+            raise TypeError(f"Cannot spool values of type {type(value).__name__}")
+    return b"".join(parts)
+
+
+def decode_rows(payload: bytes) -> List[tuple]:
+    rows = []
+    view = memoryview(payload)
+    offset = 0
+    while offset < len(view):
+        (fields,) = ROW.unpack_from(view, offset)
+        offset += ROW.size
+        row = []
+        for _ in range(fields):
+            tag = view[offset]
+            offset += 1
+            if tag == NONE:
+                row.append(None)
+            elif tag == TRUE:
+                row.append(True)
+            elif tag == FALSE:
+                row.append(False)
+            elif tag == INTEGER:
+                row.append(INT.unpack_from(view, offset)[0])
+                offset += INT.size
+            elif tag == STRING:
+                (length,) = LENGTH.unpack_from(view, offset)
+                offset += LENGTH.size
+                row.append(str(view[offset : offset + length], "utf-8"))
+                offset += length
+            elif tag == DATETIME:
+                row.append(EPOCH + timedelta(microseconds=INT.unpack_from(view, offset)[0]))
+                offset += INT.size
+            else:
+                raise ValueError(f"Unknown spool tag {tag}")
+        rows.append(tuple(row))
+    return rows
+
+
+def _complete_size(path: Path) -> int:
+    """Size of the file up to the end of its last complete frame."""
+    size = path.stat().st_size
+    end = 0
+    with path.open("rb") as f:
+        while end + FRAME.size <= size:
+            f.seek(end)
+            length, _ = FRAME.unpack(f.read(FRAME.size))
+            if end + FRAME.size + length > size:
+                break
+            end += FRAME.size + length
+    return end
+
+
+def _trim(path: Path):
+    """Cuts a partially written frame off the end of the file, so frames appended after it stay readable."""
+    try:
+        end = _complete_size(path)
+    except FileNotFoundError:
+        return
+    if end < path.stat().st_size:
+        log.warning("Dropping partially written frame at the end of %s", path)
+        with path.open("r+b") as f:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _has_data(path: Path) -> bool:
+    try:
+        return path.stat().st_size > 0
+    except FileNotFoundError:
+        return False
+
+
+class Spool:
+    """Append-only file of length-prefixed row batches.
+
+    Used to park rows that could not be written to the database, so they can be replayed later.
+    A frame that was only partially written (for example because the process was killed mid-write)
+    is cut off before anything else is appended, and ignored when it is still the last frame.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        # whether a torn frame left by an earlier process was cut off the end of the file yet
+        self._trimmed = False
+
+    def __bool__(self):
+        return _has_data(self.path) or _has_data(self._replay_path)
+
+    @property
+    def _replay_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".replay")
+
+    def take(self) -> "Spool":
+        """Moves everything written so far into a separate replay spool.
+
+        Writes made while the returned spool is being replayed go to a fresh file, so clearing the
+        replay spool afterwards can't drop them. A replay spool left over from a failed replay is
+        kept, and newer frames are appended to it.
+        """
+        replay = self._replay_path
+        if _has_data(self.path):
+            _trim(self.path)
+            if _has_data(replay):
+                _trim(replay)
+                with replay.open("ab") as dest, self.path.open("rb") as src:
+                    while chunk := src.read(1 << 16):
+                        dest.write(chunk)
+                    dest.flush()
+                    os.fsync(dest.fileno())
+                self.path.unlink()
+            else:
+                os.replace(self.path, replay)
+        return Spool(str(replay))
+
+    def write(self, kind: int, rows: Iterable[tuple]) -> None:
+        payload = b"".join(encode_row(row) for row in rows)
+        if not payload:
+            return
+        if not self._trimmed:
+            _trim(self.path)
+            self._trimmed = True
+        try:
+            with self.path.open("ab") as f:
+                f.write(FRAME.pack(len(payload), kind) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            # the frame may be half written, check again before the next one
+            self._trimmed = False
+            raise
+
+    def read(self) -> Iterator[Tuple[int, List[tuple]]]:
+        if not self:
+            return
+        with self.path.open("rb") as f:
+            while header := f.read(FRAME.size):
+                if len(header) < FRAME.size:
+                    log.warning("Ignoring truncated frame header at the end of %s", self.path)
+                    return
+                length, kind = FRAME.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    log.warning("Ignoring truncated frame at the end of %s", self.path)
+                    return
+                try:
+                    rows = decode_rows(payload)
+                except (ValueError, *DECODE_ERRORS) as exc:
+                    raise CorruptSpool(f"Could not decode frame in {self.path}: {exc!r}") from exc
+                yield kind, rows
+
+    def quarantine(self) -> Path:
+        """Moves an undecodable spool aside, so it stops blocking every replay but is kept for inspection."""
+        dest = self.path.with_name(f"{self.path.name}.corrupt-{dt.utcnow():%Y%m%d%H%M%S}")
+        os.replace(self.path, dest)
+        return dest
+
+    def clear(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -1,19 +1,29 @@
+import json
+
 from starlette.applications import Starlette
-from starlette.responses import Response, RedirectResponse
+from starlette.responses import JSONResponse, Response, RedirectResponse, StreamingResponse
 from starlette.routing import Route, Mount
 from starlette.requests import Request
 from starlette.templating import Jinja2Templates
 from starlette.staticfiles import StaticFiles
+import config
 from web import ipc
+from web.broadcast import Broadcaster
+from web.cache import IPCCache
 
 templates = Jinja2Templates(directory="web/templates")
-client = ipc.Client()
+client = ipc.Client(path=config.ipc_path)
+# seconds each IPC endpoint's result is served without asking the bot again
+cache = IPCCache(client, freshness={"stats": 30, "latency": 5})
+# every open dashboard shares the single "metrics" subscription to the bot
+metrics = Broadcaster()
 
 bot_name = "Walrus"
 
 
 async def start():
     await client.initiate()
+    await client.subscribe("metrics", metrics.publish, cadence=2)
 
 
 async def stop():
@@ -21,7 +31,7 @@ async def stop():
 
 
 async def index(request: Request) -> Response:
-    stats = await client.request("stats")
+    stats = await cache.request("stats")
     return templates.TemplateResponse(
         "index.jinja", context={"request": request, "name": bot_name, "stats": stats}
     )
@@ -35,9 +45,37 @@ async def stats(request):
     return templates.TemplateResponse("stats.jinja", context={"request": request, "name": bot_name})
 
 
+async def stats_stream(request):
+    async def events():
+        async for delta in metrics.listen():
+            if await request.is_disconnected():
+                return
+            yield f"data: {json.dumps(delta)}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+async def latency(request):
+    latencies = await cache.request("latency")
+    # the cache already falls back to the last good value, so this only fails before there is one
+    if latencies is None:
+        return JSONResponse({"error": "The bot is not connected."}, status_code=503)
+    if "error" in latencies:
+        return JSONResponse({"error": latencies["error"]}, status_code=503)
+    return JSONResponse(latencies)
+
+
+async def cache_stats(request):
+    return JSONResponse(cache.stats())
+
+
 routes = [
     Route("/", endpoint=index),
     Route("/stats", endpoint=stats),
+    Route("/stats/stream", endpoint=stats_stream),
+    Route("/stats/latency", endpoint=latency),
+    Route("/api/cache", endpoint=cache_stats),
     Mount("/static", StaticFiles(directory="web/static")),
 ]
 
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Set
+
+__all__ = ("Broadcaster",)
+
+log = logging.getLogger("broadcaster")
+
+
+class Broadcaster:
+    """Fans values out from one producer to any number of listeners.
+
+    Each listener gets a small queue of its own. A listener that falls behind loses its oldest
+    values instead of holding everyone else up.
+    """
+
+    def __init__(self, *, backlog: int = 16):
+        self.backlog = backlog
+        self._listeners: Set[asyncio.Queue] = set()
+
+    def __len__(self):
+        return len(self._listeners)
+
+    def publish(self, value: Any):
+        for queue in self._listeners:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(value)
+
+    async def listen(self) -> AsyncIterator[Any]:
+        queue = asyncio.Queue(maxsize=self.backlog)
+        self._listeners.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._listeners.discard(queue)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from collections import Counter
+from time import monotonic
+from typing import Any, Dict, Optional, Tuple
+
+from web.ipc import Client
+
+__all__ = ("IPCCache",)
+
+log = logging.getLogger("ipc_cache")
+
+
+class IPCCache:
+    """Stale-while-revalidate cache in front of an IPC client.
+
+    A fresh result is served straight from memory. Once it goes stale it is still served, while a
+    single background request refreshes it, so each endpoint costs at most one IPC call per freshness
+    interval no matter how many requests come in.
+    """
+
+    def __init__(
+        self, client: Client, freshness: Optional[Dict[str, float]] = None, *, default: float = 10.0
+    ):
+        self.client = client
+        self.freshness = freshness or {}
+        self.default = default
+
+        self._entries: Dict[Tuple, Tuple[Any, float]] = {}
+        self._refreshing: Dict[Tuple, asyncio.Task] = {}
+
+        self.hits = Counter()
+        self.stale = Counter()
+        self.misses = Counter()
+
+    async def request(self, endpoint: str, **kwargs) -> Any:
+        key = (endpoint, *sorted(kwargs.items()))
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses[endpoint] += 1
+            # shielded so a caller going away doesn't cancel the request others are waiting on
+            return await asyncio.shield(self._refresh(key, endpoint, kwargs))
+
+        value, fetched = entry
+        if monotonic() - fetched < self.freshness.get(endpoint, self.default):
+            self.hits[endpoint] += 1
+        else:
+            self.stale[endpoint] += 1
+            self._refresh(key, endpoint, kwargs)
+
+        return value
+
+    def _refresh(self, key: Tuple, endpoint: str, kwargs: dict) -> asyncio.Task:
+        task = self._refreshing.get(key)
+        if task is None:
+            task = self._refreshing[key] = asyncio.get_running_loop().create_task(
+                self._fetch(key, endpoint, kwargs)
+            )
+        return task
+
+    async def _fetch(self, key: Tuple, endpoint: str, kwargs: dict) -> Any:
+        try:
+            value = await self.client.request(endpoint, **kwargs)
+        finally:
+            del self._refreshing[key]
+
+        if value is None or (isinstance(value, dict) and "error" in value):
+            log.warning(f"Not caching failed response for {endpoint}: {value!r}")
+            # keep serving the last good value, if there is one
+            entry = self._entries.get(key)
+            return value if entry is None else entry[0]
+
+        self._entries[key] = (value, monotonic())
+        return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        endpoints = set(self.hits) | set(self.stale) | set(self.misses)
+        return {
+            endpoint: {
+                "hits": self.hits[endpoint],
+                "stale": self.stale[endpoint],
+                "misses": self.misses[endpoint],
+            }
+            for endpoint in endpoints
+        }
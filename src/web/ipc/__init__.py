@@ -1,5 +1,7 @@
 import asyncio
-from typing import Any, Optional
+from itertools import count
+from json import dumps
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import aiohttp
 import aiohttp.web
 from traceback import format_exception
@@ -11,17 +13,41 @@ server = logging.getLogger("ipc_server")
 
 
 class Client:
-    def __init__(self, host: str = "localhost", port: int = 6666, key="very secret key"):
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6666,
+        key="very secret key",
+        *,
+        path: Optional[str] = None,
+        timeout: float = 10.0,
+        max_in_flight: int = 100,
+    ):
         self.loop = asyncio.get_event_loop()
         self.session: Optional[aiohttp.ClientSession] = None
         self.websocket = None
 
         self.host = host
         self.port = port
+        # connect over this unix domain socket instead of TCP when given
+        self.path = path
         self.key = key
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+        # responses are matched to their request by nonce, so many requests can share the socket
+        self._nonces = count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        # stream name -> (callback, cadence), re-sent whenever the connection is re-established
+        self._subscriptions: Dict[str, Tuple[Callable[[Any], Any], float]] = {}
+        self._reader: Optional[asyncio.Task] = None
 
     @property
     def url(self):
+        if self.path is not None:
+            # the host is only used for the Host header here
+            return "ws://localhost/"
         return f"ws://{self.host}:{self.port}"
 
     async def request(self, endpoint: str, **kwargs) -> Any:
@@ -29,101 +55,226 @@ class Client:
             return None
         client.info(f"Requesting IPC Server for {endpoint}")
 
-        payload = {"endpoint": endpoint, "auth": self.key, "kwargs": kwargs}
-        await self.websocket.send_json(payload)
-
-        recv = await self.websocket.receive()
+        return await self._send({"endpoint": endpoint, "kwargs": kwargs}, endpoint)
 
-        if recv.type == aiohttp.WSMsgType.PING:
-            client.info("Received request to PING")
-            await self.websocket.ping()
+    async def batch(self, *calls: Union[str, Tuple[str, dict]]) -> Optional[List[dict]]:
+        """Calls several endpoints in one round trip.
 
-            return await self.request(endpoint, **kwargs)
+        Each call is either an endpoint name or an (endpoint, kwargs) tuple. The result has one entry
+        per call, in order, shaped like {"data": ..., "code": 200} or {"error": ..., "code": ...}.
+        """
+        if self.websocket is None:
+            return None
+        calls = [(call, {}) if isinstance(call, str) else call for call in calls]
+        names = ", ".join(endpoint for endpoint, _ in calls)
+        client.info(f"Requesting IPC Server for a batch of {names}")
+
+        payload = {"batch": [{"endpoint": endpoint, "kwargs": kwargs} for endpoint, kwargs in calls]}
+        response = await self._send(payload, names)
+        if isinstance(response, dict):
+            # the batch as a whole failed, e.g. it timed out or wasn't authorized
+            return [response] * len(calls)
+        return response
+
+    async def _send(self, payload: dict, description: str) -> Any:
+        async with self._in_flight:
+            nonce = next(self._nonces)
+            future = self._pending[nonce] = self.loop.create_future()
+            try:
+                await self.websocket.send_json({**payload, "auth": self.key, "nonce": nonce})
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                client.warning(f"Request for {description} timed out after {self.timeout} seconds.")
+                return {"error": "IPC request timed out", "code": 504}
+            except ConnectionResetError:
+                return {"error": "IPC connection closed", "code": 503}
+            finally:
+                self._pending.pop(nonce, None)
+
+    async def _read(self):
+        while True:
+            recv = await self.websocket.receive()
+
+            if recv.type == aiohttp.WSMsgType.PING:
+                client.info("Received request to PING")
+                await self.websocket.pong()
+                continue
+
+            if recv.type == aiohttp.WSMsgType.PONG:
+                client.info("Received PONG")
+                continue
+
+            if recv.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                break
+
+            data = recv.json()
+            if (name := data.get("subscription")) is not None:
+                if (subscription := self._subscriptions.get(name)) is not None:
+                    subscription[0](data["data"])
+                continue
+
+            future = self._pending.get(data.get("nonce"))
+            if future is not None and not future.done():
+                future.set_result(data.get("data"))
+
+        client.error("WebSocket connection closed.")
+        self.websocket = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result({"error": "IPC connection closed", "code": 503})
 
-        if recv.type == aiohttp.WSMsgType.PONG:
-            client.info("Received PONG")
-            return await self.request(endpoint, **kwargs)
+        await self.session.close()
+        await self._reconnect()
 
-        if recv.type == aiohttp.WSMsgType.CLOSED:
-            client.error("WebSocket connection closed.")
-            await self.session.close()
+    async def _reconnect(self):
+        while True:
             await asyncio.sleep(5)
-
-            while self.websocket is None:
-                await self.initiate()
-            return await self.request(endpoint, **kwargs)
-
-        return recv.json()
+            if await self._connect():
+                return
 
     async def initiate(self):
         client.info("Instantiating websocket.")
-        self.session = aiohttp.ClientSession()
+        # the client may be created before the loop that serves requests is running
+        self.loop = asyncio.get_running_loop()
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        if not await self._connect():
+            # the bot may not be up yet, keep trying in the background like after a disconnect
+            client.warning("Could not connect to the IPC server, retrying every 5 seconds.")
+            self._reader = self.loop.create_task(self._reconnect())
+
+    async def _connect(self) -> bool:
+        connector = aiohttp.UnixConnector(path=self.path) if self.path is not None else None
+        self.session = aiohttp.ClientSession(connector=connector)
 
         try:
             self.websocket = await self.session.ws_connect(self.url, autoclose=False, autoping=False)
         except ClientConnectionError:
-            pass
+            await self.session.close()
+            return False
+
+        self._reader = self.loop.create_task(self._read())
+        # the server forgets subscriptions with the connection they came in on. a copy, since subscribe()
+        # can add one meanwhile, which it sends itself as the websocket is already set
+        for name, (_, cadence) in list(self._subscriptions.items()):
+            await self._send_subscribe(name, cadence)
+        return True
+
+    async def _send_subscribe(self, name: str, cadence: float):
+        await self.websocket.send_json({"subscribe": name, "auth": self.key, "cadence": cadence})
+
+    async def subscribe(self, name: str, callback: Callable[[Any], Any], *, cadence: float = 1.0):
+        """Asks the server to push the stream `name` every `cadence` seconds, passing each value to `callback`."""
+        self._subscriptions[name] = (callback, cadence)
+        if self.websocket is not None:
+            await self._send_subscribe(name, cadence)
 
     async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
         await self.session.close()
-        await self.websocket.close()
+        if self.websocket is not None:
+            await self.websocket.close()
 
 
 class Server:
     ENDPOINTS = {}
-
-    def __init__(self, bot, host: str = "localhost", port: int = 6666, key="very secret key"):
+    STREAMS = {}
+
+    def __init__(
+        self,
+        bot,
+        host: str = "localhost",
+        port: int = 6666,
+        key="very secret key",
+        *,
+        path: Optional[str] = None,
+    ):
         self.loop = asyncio.get_event_loop()
         self._server = None
 
         self.bot = bot
         self.host = host
         self.port = port
+        # listen on this unix domain socket instead of TCP when given
+        self.path = path
         self.key = key
 
     async def __start__(self):
+        self._server = aiohttp.web.Application()
+        self._server.router.add_route("GET", "/", self.handle_ws)
+
         runner = aiohttp.web.AppRunner(self._server)
         await runner.setup()
 
-        site = aiohttp.web.TCPSite(runner, self.host, self.port)
+        if self.path is not None:
+            site = aiohttp.web.UnixSite(runner, self.path)
+        else:
+            site = aiohttp.web.TCPSite(runner, self.host, self.port)
         await site.start()
 
     def start(self):
-        self._server = aiohttp.web.Application()
-        self._server.router.add_route("GET", "/", self.handle_ws)
-
         self.loop.run_until_complete(self.__start__())
 
+    async def call(self, endpoint: Optional[str], kwargs: dict) -> Any:
+        func = self.ENDPOINTS.get(endpoint)
+        if not endpoint:
+            server.info("Received a request with no endpoint.")
+            return {"error": "No Endpoint Provided", "code": 400}
+        if func is None:
+            return {"error": "Invalid Endpoint provided", "code": 400}
+
+        cog = self.bot.get_cog(func.__qualname__.split(".", maxsplit=1)[0])
+        if cog:
+            args = [cog, kwargs]
+        else:
+            args = [self.bot, kwargs]
+        if kwargs == {}:
+            del args[1]
+
+        try:
+            return await func(*args)
+        except Exception as err:
+            server.error(f"Recieved error while executing {err}")
+            return {"error": f"IPC route raised error of type {type(err).__name__}", "code": 500}
+
+    async def call_batch(self, calls: List[dict]) -> List[dict]:
+        """Runs every call of a batch concurrently, each one succeeding or failing on its own."""
+        results = await asyncio.gather(*(self.call(c.get("endpoint"), c.get("kwargs", {})) for c in calls))
+
+        responses = []
+        for call, result in zip(calls, results):
+            if isinstance(result, dict) and "error" in result and "code" in result:
+                responses.append(result)
+                continue
+            try:
+                dumps(result)
+            except TypeError:
+                server.error(
+                    f"IPC route {call.get('endpoint')} returned values which are not able to be sent."
+                )
+                result = {
+                    "error": "IPC route returned values which are not able to be sent over sockets.",
+                    "code": 500,
+                }
+                responses.append(result)
+            else:
+                responses.append({"data": result, "code": 200})
+        return responses
+
     async def handle_json(self, ws, json: dict):
         if json.get("auth") != self.key:
             server.warning("Recieved unauthorized request.")
             response = {"error": "Invalid token provided", "code": 403}
+        elif "batch" in json:
+            response = await self.call_batch(json["batch"])
         else:
-            endpoint = json.get("endpoint")
-            func = self.ENDPOINTS.get(endpoint)
-            if not endpoint:
-                server.info("Received a request with no endpoint.")
-                response = {"error": "No Endpoint Provided", "code": 400}
-            elif func is None:
-                response = {"error": "Invalid Endpoint provided", "code": 400}
-            else:
-                cog = self.bot.get_cog(func.__qualname__.split(".", maxsplit=1)[0])
-                kwargs = json["kwargs"]
-                if cog:
-                    args = [cog, kwargs]
-                else:
-                    args = [self.bot, kwargs]
-                if kwargs == {}:
-                    del args[1]
-
-                try:
-                    response = await func(*args)
-                except Exception as err:
-                    server.error(f"Recieved error while executing {err}")
-                    response = {"error": f"IPC route raised error of type {type(err).__name__}", "code": 500}
+            response = await self.call(json.get("endpoint"), json["kwargs"])
 
+        nonce = json.get("nonce")
         try:
-            await ws.send_json(response)
+            await ws.send_json({"nonce": nonce, "data": response})
         except TypeError as error:
             if str(error).startswith("Object of type") and str(error).endswith("is not JSON serializable"):
                 server.error("IPC route returned values which are not able to be sent over sockets.")
@@ -133,16 +284,50 @@ class Server:
                     "code": 500,
                 }
 
-                await ws.send_json(response)
+                await ws.send_json({"nonce": nonce, "data": response})
+
+    async def push(self, ws, name: str, cadence: float):
+        """Sends the next value of a stream to a subscriber every `cadence` seconds."""
+        stream = self.STREAMS[name](self.bot)
+        while not ws.closed:
+            await asyncio.sleep(cadence)
+            try:
+                await ws.send_json({"subscription": name, "data": next(stream)})
+            except ConnectionResetError:
+                return
+
+    def subscribe(self, ws, json: dict) -> Optional[asyncio.Task]:
+        name = json["subscribe"]
+        if json.get("auth") != self.key:
+            server.warning("Recieved unauthorized subscription.")
+            return None
+        if name not in self.STREAMS:
+            server.info(f"Received a subscription to unknown stream {name}.")
+            return None
+
+        server.info(f"Client subscribed to {name}.")
+        return self.loop.create_task(self.push(ws, name, float(json.get("cadence", 1))))
 
     async def handle_ws(self, request):
         ws = aiohttp.web.WebSocketResponse()
         await ws.prepare(request)
 
+        subscriptions = []
         async for data in ws:
             json = data.json()
 
-            await self.handle_json(ws, json)
+            if "subscribe" in json:
+                if (task := self.subscribe(ws, json)) is not None:
+                    subscriptions.append(task)
+                continue
+
+            # requests are answered as they finish, the client matches them up by nonce
+            self.loop.create_task(self.handle_json(ws, json))
+
+        for task in subscriptions:
+            task.cancel()
+
+        return ws
 
 
 def route(name=None):
@@ -153,3 +338,12 @@ def route(name=None):
             Server.ENDPOINTS[name] = func
 
     return deco
+
+
+def stream(name=None):
+    """Registers a generator function, called with the bot, whose values are pushed to subscribers."""
+
+    def deco(func):
+        Server.STREAMS[name or func.__name__] = func
+
+    return deco